@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import logging
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from column_store import ColumnRelation, MISSING, symbol_columns
+from tokens import SYMBOLS
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+trace = Trace(logger, 'catalog')
+
+# The number of most common values of a column that heavy_hitters returns by default
+HEAVY_HITTERS = 8
+
+
+class ColumnStatistics:
+    """
+    How many times each symbol is in a column, as the sorted symbols and their counts.  Only the symbols that are in
+    the column take space, and new rows are merged in without counting the old rows again.
+    """
+    __slots__ = ('symbols', 'counts', 'missing')
+
+    def __init__(self):
+        self.symbols = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        # The number of rows that have no value in the column
+        self.missing = 0
+
+    def add(self, column: np.ndarray):
+        """
+        Count the symbols of new rows
+        """
+        present = column[column != MISSING]
+        self.missing += len(column) - len(present)
+        symbols, counts = np.unique(present, return_counts=True)
+        positions = np.searchsorted(self.symbols, symbols)
+        found = positions < len(self.symbols)
+        found[found] = self.symbols[positions[found]] == symbols[found]
+        self.counts[positions[found]] += counts[found]
+        if not found.all():
+            new = ~found
+            self.symbols = np.insert(self.symbols, positions[new], symbols[new])
+            self.counts = np.insert(self.counts, positions[new], counts[new])
+
+    @property
+    def distinct(self) -> int:
+        return len(self.symbols)
+
+    @property
+    def selectivity(self) -> float:
+        """
+        :return: The fraction of the rows with a value that have any one value, if the values are equally common
+        """
+        return 1 / self.distinct if self.distinct else 0.0
+
+    def count(self, symbol: int) -> int:
+        """
+        :return: The number of rows with the symbol in the column
+        """
+        position = np.searchsorted(self.symbols, symbol)
+        if position < len(self.symbols) and self.symbols[position] == symbol:
+            return int(self.counts[position])
+        return 0
+
+    def heavy_hitters(self, k: int = HEAVY_HITTERS) -> List[Tuple[int, int]]:
+        """
+        :return: The k most common symbols in the column and their counts, most common first
+        """
+        top = np.argpartition(-self.counts, k)[:k] if k < len(self.counts) else np.arange(len(self.counts))
+        top = top[np.lexsort((self.symbols[top], -self.counts[top]))]
+        return list(zip(self.symbols[top].tolist(), self.counts[top].tolist()))
+
+    def __str__(self) -> str:
+        return "{} distinct, most common {}".format(self.distinct, ", ".join(
+            "{}x{}".format(SYMBOLS[symbol], count) for symbol, count in self.heavy_hitters(3)))
+
+
+class RelationStatistics:
+    """
+    The number of rows of a relation and the statistics of each of its columns
+    """
+    __slots__ = ('rows', 'columns', 'unique')
+
+    def __init__(self, width: int, unique: bool = True):
+        """
+        :param unique: If the rows that are counted have no duplicates, so rows that are added to the relation later
+        leave the rows before them as they are
+        """
+        self.rows = 0
+        self.columns = [ColumnStatistics() for _ in range(width)]
+        self.unique = unique
+
+    def add(self, columns: Sequence[np.ndarray]):
+        """
+        Count new rows, given as their columns
+        """
+        for statistics, column in zip(self.columns, columns):
+            statistics.add(column)
+        self.rows += len(columns[0]) if len(columns) else 0
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: The number of bytes that the columns of symbols of the relation take
+        """
+        return self.rows * len(self.columns) * np.dtype(np.int64).itemsize
+
+    def estimate(self, constants: Sequence[Tuple[int, int]]) -> float:
+        """
+        Estimate the number of rows that a selection keeps, assuming that the columns are independent
+        :param constants: Pairs of a column and a symbol, like QueryPlan.constants
+        """
+        rows = float(self.rows)
+        for column, symbol in constants:
+            if column >= len(self.columns) or not self.rows:
+                return 0.0
+            rows *= self.columns[column].count(symbol) / self.rows
+        return rows
+
+    def __str__(self) -> str:
+        return "{} rows, {} bytes{}".format(self.rows, self.nbytes, "".join(
+            "\n    {}: {}".format(i, column) for i, column in enumerate(self.columns)))
+
+
+class Catalog:
+    """
+    The statistics of each relation in a database by the symbol of its name.
+    Relations change on every pass through the rules, so a change is only noted when it happens, and the rows of the
+    relation are counted the next time its statistics are read, counting only the rows that are new when they can
+    """
+    def __init__(self):
+        self.statistics = dict()  # type: Dict[int, RelationStatistics]
+        # The newest relation of each symbol whose statistics are out of date, the number of its first rows that were
+        # counted already, or None if every row is counted, and if those rows have no duplicates
+        self.changed = dict()  # type: Dict[int, Tuple[object, Optional[int], bool]]
+
+    def count(self, symbol: int, relation, unique: bool = True):
+        """
+        Every row of a relation is counted, replacing any statistics that it had
+        :param relation: A ColumnRelation or a pandas relation
+        :param unique: If the relation has no duplicate rows
+        """
+        self.changed[symbol] = (relation, None, unique)
+
+    def extend(self, symbol: int, relation, start: int):
+        """
+        The rows of a relation after its first start rows are counted, the rows before them were counted already.
+        If the counted rows may have had duplicates then they may not be first any more, so every row is counted
+        :param relation: A ColumnRelation or a pandas relation
+        """
+        if symbol not in self.changed:
+            self.changed[symbol] = (relation, start, True)
+            return
+        previous, counted, _ = self.changed[symbol]
+        if counted is None or start != len(previous):
+            # Counting the rows of the previous relation and then the new rows would count the whole relation anyway
+            self.changed[symbol] = (relation, None, True)
+        else:
+            self.changed[symbol] = (relation, counted, True)
+
+    def get(self, symbol: int) -> Optional[RelationStatistics]:
+        """
+        :return: The statistics of a relation, counting any rows that changed since they were last read
+        """
+        if symbol in self.changed:
+            self._update(symbol)
+        return self.statistics.get(symbol)
+
+    def _update(self, symbol: int):
+        relation, start, unique = self.changed.pop(symbol)
+        statistics = self.statistics.get(symbol)
+        if start is None or statistics is None or not statistics.unique or statistics.rows != start:
+            columns = symbol_columns(relation)
+            statistics = RelationStatistics(len(columns), unique if start is None else True)
+            statistics.add(columns)
+            self.statistics[symbol] = statistics
+            trace('count', "Counted {} rows of {}", statistics.rows, SYMBOLS[symbol])
+            return
+        if isinstance(relation, ColumnRelation):
+            columns = [column[start:] for column in relation.columns]
+        else:
+            columns = symbol_columns(relation.iloc[start:])
+        statistics.add(columns)
+        trace('extend', "Counted {} new rows of {}", statistics.rows - start, SYMBOLS[symbol])
+
+    def __getitem__(self, symbol: int) -> RelationStatistics:
+        statistics = self.get(symbol)
+        if statistics is None:
+            raise KeyError(symbol)
+        return statistics
+
+    def __contains__(self, symbol: int) -> bool:
+        return symbol in self.changed or symbol in self.statistics
+
+    def __str__(self) -> str:
+        for symbol in list(self.changed):
+            self._update(symbol)
+        return "\n".join("  {}: {}".format(SYMBOLS[symbol], statistics)
+                         for symbol, statistics in sorted(self.statistics.items(), key=lambda item: SYMBOLS[item[0]]))
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+import logging
+
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+trace = Trace(logger, 'columns')
+
+# The value of a cell that has no symbol, like a None in a pandas relation
+MISSING = -1
+# Keys of rows are int64
+_KEY_LIMIT = 1 << 62
+
+
+def row_keys(columns: Sequence[np.ndarray], rows: int) -> np.ndarray:
+    """
+    Fold the columns of a table into one key per row, rows that are equal have the same key
+    :param columns: Columns of symbols, all the same length
+    :param rows: The number of rows, for tables without columns
+    :return: An int64 array of keys that aren't negative
+    """
+    key = np.zeros(rows, dtype=np.int64)
+    if not rows:
+        return key
+    # Every key is less than span
+    span = 1
+    for column in columns:
+        base = int(column.max()) + 2
+        if span * base > _KEY_LIMIT:
+            # Renumber the keys from 0 so that they fit again, there are at most as many as there are rows
+            _, key = np.unique(key, return_inverse=True)
+            span = int(key.max()) + 1
+        key = key * base + (column + 1)
+        span *= base
+    return key.astype(np.int64, copy=False)
+
+
+def symbol_columns(relation) -> Tuple[np.ndarray, ...]:
+    """
+    :param relation: A ColumnRelation or a pandas relation
+    :return: The columns of symbols of the relation, where a None in a pandas relation is MISSING
+    """
+    if isinstance(relation, ColumnRelation):
+        return relation.columns
+    if not relation.shape[1]:
+        return ()
+    return tuple(relation.fillna(MISSING).values.astype(np.int64).T)
+
+
+class ColumnIndex:
+    """
+    The rows of a column sorted by their symbols, so that the rows with a symbol are found by a binary search instead
+    of a scan.  Symbols are small integers, so sorted arrays cost far less memory than a hash table of rows.
+    Rows that are added later go in a run of their own, and runs are merged once they are as big as the run before
+    them, so there are only logarithmically many runs to search.
+    """
+    __slots__ = ('runs',)
+
+    def __init__(self, column: np.ndarray):
+        self.runs = []  # type: List[Tuple[np.ndarray, np.ndarray]]
+        self.extend(column, 0)
+
+    def extend(self, column: np.ndarray, offset: int):
+        """
+        Add rows to the index
+        :param column: The values of the new rows
+        :param offset: The row number of the first new row, after every row already in the index
+        """
+        if not len(column):
+            return
+        order = np.argsort(column, kind='mergesort')
+        self.runs.append((column[order], order + offset))
+        while len(self.runs) > 1 and 2 * len(self.runs[-1][0]) >= len(self.runs[-2][0]):
+            (keys, rows), (new_keys, new_rows) = self.runs[-2:]
+            keys, rows = np.concatenate((keys, new_keys)), np.concatenate((rows, new_rows))
+            # A stable sort keeps the rows of each symbol in order, since the new rows come after the others
+            order = np.argsort(keys, kind='mergesort')
+            self.runs[-2:] = [(keys[order], rows[order])]
+
+    def rows(self, symbol: int) -> np.ndarray:
+        """
+        :return: The rows that have the symbol, in order
+        """
+        found = [
+            rows[np.searchsorted(keys, symbol, side='left'):np.searchsorted(keys, symbol, side='right')]
+            for keys, rows in self.runs
+        ]
+        return found[0] if len(found) == 1 else np.concatenate(found or [np.empty(0, dtype=np.int64)])
+
+
+class ColumnRelation:
+    """
+    A relation stored as a tuple of int64 columns of symbols, with the name of each column kept separately.
+    Names are the symbols of variables once a relation is renamed, or the positions of the columns before that.
+    Operations return new relations and never change the arrays that they are given.
+    The indexes of columns are built the first time that a column is selected on.
+    """
+    __slots__ = ('names', 'columns', 'indexes')
+
+    def __init__(self, columns: Iterable[np.ndarray] = (), names: Iterable[int] = None):
+        self.columns = tuple(np.asarray(column, dtype=np.int64) for column in columns)
+        self.names = list(range(len(self.columns)) if names is None else names)
+        self.indexes = {}  # type: Dict[int, ColumnIndex]
+        if len(self.names) != len(self.columns):
+            raise ValueError("{} names for {} columns".format(len(self.names), len(self.columns)))
+
+    @property
+    def empty(self) -> bool:
+        return not self.columns or not len(self.columns[0])
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        :return: The rows of the relation as a 2d array
+        """
+        return np.column_stack(self.columns) if self.columns else np.empty((0, 0), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.names)
+
+    def take(self, rows: np.ndarray) -> 'ColumnRelation':
+        """
+        :param rows: A boolean mask or the indices of the rows to keep
+        """
+        return ColumnRelation((column[rows] for column in self.columns), self.names)
+
+    def index(self, column: int) -> ColumnIndex:
+        """
+        :return: The index of a column, which is built if it doesn't exist yet
+        """
+        if column not in self.indexes:
+            trace('index', "Indexing column {} of {} rows", column, len(self))
+            self.indexes[column] = ColumnIndex(self.columns[column])
+        return self.indexes[column]
+
+    def select(self, constants: Sequence[Tuple[int, int]]) -> 'ColumnRelation':
+        """
+        Keep the rows that have the symbols in the columns.
+        The rows with the first symbol are looked up in the index of its column, and only those rows are checked for
+        the other symbols
+        :param constants: Pairs of a column and a symbol
+        """
+        if not constants:
+            return self
+        (column, symbol), *others = constants
+        rows = self.index(column).rows(symbol)
+        for column, symbol in others:
+            rows = rows[self.columns[column][rows] == symbol]
+        return self.take(rows)
+
+    def project(self, indices: Sequence[int]) -> 'ColumnRelation':
+        """
+        Keep the columns at the indices, in that order.
+        An index past the last column is a column of missing values, like pandas' reindex
+        """
+        columns = [
+            self.columns[i] if i < len(self.columns) else np.full(len(self), MISSING, dtype=np.int64)
+            for i in indices
+        ]
+        return ColumnRelation(columns, [self.names[i] if i < len(self.names) else i for i in indices])
+
+    def rename(self, names: Iterable[int]) -> 'ColumnRelation':
+        return ColumnRelation(self.columns, names)
+
+    def dropna(self) -> 'ColumnRelation':
+        """
+        Remove the rows that are missing a value in any column
+        """
+        if not self.columns:
+            return self
+        present = np.logical_and.reduce([column != MISSING for column in self.columns])
+        return self if present.all() else self.take(present)
+
+    def _first_rows(self) -> np.ndarray:
+        """
+        :return: The first row of each set of equal rows, in order
+        """
+        _, first = np.unique(row_keys(self.columns, len(self)), return_index=True)
+        return np.sort(first)
+
+    def unique(self) -> 'ColumnRelation':
+        """
+        Remove duplicate rows, keeping the first of each in order
+        """
+        if len(self) < 2:
+            return self
+        first = self._first_rows()
+        return self if len(first) == len(self) else self.take(first)
+
+    def union(self, other: 'ColumnRelation') -> 'ColumnRelation':
+        """
+        Append the rows of the other relation and remove duplicates, like append and then unique.
+        If the rows of this relation are all kept then its indexes are updated with the new rows and moved to the
+        result, so this relation has none afterwards
+        :return: This relation if none of the rows are new
+        """
+        relation = self.append(other)
+        first = relation._first_rows()
+        size = len(self)
+        kept = len(first) >= size and (not size or first[size - 1] == size - 1)
+        if kept and len(first) == size and len(relation.columns) == len(self.columns):
+            return self
+        if len(first) < len(relation):
+            relation = relation.take(first)
+        if self.indexes and kept:
+            for column, index in self.indexes.items():
+                index.extend(relation.columns[column][size:], size)
+            relation.indexes, self.indexes = self.indexes, {}
+        return relation
+
+    def append(self, other: 'ColumnRelation') -> 'ColumnRelation':
+        """
+        The rows of this relation followed by the rows of the other, which must be numbered the same way.
+        The narrower relation is padded with missing values
+        """
+        width = max(len(self.columns), len(other.columns))
+        columns = [
+            np.concatenate([
+                relation.columns[i] if i < len(relation.columns) else np.full(len(relation), MISSING, dtype=np.int64)
+                for relation in (self, other)
+            ])
+            for i in range(width)
+        ]
+        return ColumnRelation(columns)
+
+    def join(self, other: 'ColumnRelation') -> 'ColumnRelation':
+        """
+        Natural join on the columns with the same names, or the cross product if there are none.
+        The columns of the result are the columns of this relation and then the other columns of the other relation
+        :return: Every pair of matching rows, like an inner pandas merge
+        """
+        common = [name for name in self.names if name in other.names]
+        rest = [i for i, name in enumerate(other.names) if name not in common]
+        if common:
+            left = [self.columns[self.names.index(name)] for name in common]
+            right = [other.columns[other.names.index(name)] for name in common]
+            keys = row_keys([np.concatenate(pair) for pair in zip(left, right)], len(self) + len(other))
+            left_keys, right_keys = keys[:len(self)], keys[len(self):]
+        else:
+            left_keys, right_keys = np.zeros(len(self), dtype=np.int64), np.zeros(len(other), dtype=np.int64)
+        trace('join', "Joining {} rows with {} rows on {} columns", len(self), len(other), len(common))
+
+        # Pair each row on the left with the run of rows on the right that have its key
+        order = np.argsort(right_keys, kind='mergesort')
+        sorted_keys = right_keys[order]
+        starts = np.searchsorted(sorted_keys, left_keys, side='left')
+        counts = np.searchsorted(sorted_keys, left_keys, side='right') - starts
+        left_rows = np.repeat(np.arange(len(self)), counts)
+        offsets = np.arange(len(left_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        right_rows = order[np.repeat(starts, counts) + offsets]
+
+        columns = [column[left_rows] for column in self.columns] + [other.columns[i][right_rows] for i in rest]
+        return ColumnRelation(columns, self.names + [other.names[i] for i in rest])
+
+    def collapse(self, order: Sequence[int]) -> 'ColumnRelation':
+        """
+        Keep the rows where all of the columns with the same name are equal, and then only the first column of each name
+        :param order: Each name once, in the order that the columns are kept in
+        """
+        keep = np.ones(len(self), dtype=bool)
+        first = []
+        for name in order:
+            group = [column for column, n in zip(self.columns, self.names) if n == name]
+            for column in group[1:]:
+                keep &= column == group[0]
+            first.append(self.names.index(name))
+        return self.take(keep).project(first)
+
+    def __repr__(self) -> str:
+        return "{}({} rows, names={})".format(self.__class__.__name__, len(self), self.names)
@@ -1,33 +1,78 @@
 #!/usr/bin/env python3
-import multiprocessing
 import logging
-from typing import List
+from typing import List, Sequence, TextIO, Tuple
 
 import pandas as pd
-from tokens import TokenError, Token
-import lexical_analyzer
+from column_store import ColumnRelation
+from tokens import SYMBOLS
 import datalog_parser
+import relation_store
 import relational_database
 
+from tracing import Trace
+
 logger = logging.getLogger(__name__)
+trace = Trace(logger, 'interpreter')
 
 class DatalogInterpreter(relational_database.RDBMS):
-    merge_token = Token(-1)
+    # The name of the column that relations are cross joined on, no variable has a negative symbol
+    merge_token = -1
 
-    def __init__(self, datalog_program: datalog_parser.DatalogProgram, least_fix_point: bool = True):
-        super().__init__(datalog_program)
+    def __init__(self, datalog_program: datalog_parser.DatalogProgram, least_fix_point: bool = True,
+                 engine: str = relational_database.ENGINE,
+                 query_cache_size: int = relational_database.QUERY_CACHE_SIZE,
+                 snapshot: relation_store.Snapshot = None, fact_files: Sequence[Tuple[str, str]] = ()):
+        """
+        :param snapshot: Relations to use instead of the facts, and the relations derived from them if the program has
+        the same schemes and rules as the program they were derived by
+        :param fact_files: Pairs of the name of a scheme and a CSV or TSV file of more facts to import into it
+        """
+        super().__init__(datalog_program, engine=engine, query_cache_size=query_cache_size, snapshot=snapshot,
+                         fact_files=fact_files)
         self.rules = datalog_program.rules.rules
         self.passes = 1
+        self.least_fix_point = least_fix_point
+        self.program_key = relation_store.program_key(datalog_program)
 
         # Don't evaluate rules yet if we are going to use a better algorithm to find their dependencies
         if least_fix_point:
-            logger.info("Evaluating Rules")
-            self.passes = self.evaluate_rules()
+            if self.restore(snapshot):
+                logger.info("Restored the derived relations from the snapshot")
+            else:
+                logger.info("Evaluating Rules")
+                self.passes = self.evaluate_rules()
 
             logger.info("Evaluating Queries")
             for query in datalog_program.queries.queries:
                 self.rdbms[query] = self.evaluate_query(query)
 
+    def restore(self, snapshot: relation_store.Snapshot = None) -> bool:
+        """
+        Use the relations that the rules derived when the snapshot was saved, which are only the same if all of the
+        facts came from the snapshot and the program has the same schemes and rules
+        :return: True if the relations were restored, and the rules don't need to be evaluated
+        """
+        if snapshot is None or snapshot.passes is None or snapshot.program != self.program_key or self.program_facts:
+            return False
+        for symbol, relation in snapshot.derived.items():
+            self.relations[symbol] = self.from_columns(relation.columns)
+            self.versions[symbol] = self.versions.get(symbol, 0) + 1
+            self.catalog.count(symbol, relation)
+        self.passes = snapshot.passes
+        return True
+
+    def save(self, directory: str, derived: bool = True):
+        """
+        Save a snapshot of the relations of the facts, and the relations that the rules derived from them once they
+        are all evaluated
+        :param derived: Also save the relations that rules derived
+        """
+        if not (derived and self.least_fix_point):
+            return super().save(directory, derived)
+        changed = {symbol: relation for symbol, relation in self.relations.items()
+                   if relation is not self.facts.get(symbol)}
+        relation_store.save(directory, self.facts, changed, passes=self.passes, program=self.program_key)
+
     def evaluate_rule(self, rule: datalog_parser.Rule) -> bool:
         joined = self.join(rule)
         if not joined.empty:
@@ -37,9 +82,10 @@ class DatalogInterpreter(relational_database.RDBMS):
     def evaluate_rules(self, rules: List[datalog_parser.Rule] = None) -> int:
         """
         Each rule potentially adds new facts to a relation.
-        The fixed-point algorithm repeatedly performs iterations on the rules adding new facts from each rule as the facts are generated.
-        Each iteration may change the database by adding at least one new tuple to at least one relation in the database.
-        The fixed-point algorithm terminates when an iteration of the rule expression set does not union a new tuple to any relation in the database.
+        The fixed-point algorithm repeatedly performs iterations on the rules adding new facts from each rule as the
+        facts are generated.  Each iteration may change the database by adding at least one new tuple to at least one
+        relation in the database.  The fixed-point algorithm terminates when an iteration of the rule expression set
+        does not union a new tuple to any relation in the database.
         """
         if rules is None:
             rules = self.rules
@@ -55,7 +101,7 @@ class DatalogInterpreter(relational_database.RDBMS):
         return passes
 
     def join(self, rule: datalog_parser.Rule) -> relational_database.Relation:
-        logger.debug("Evaluating '%s'" % str(rule))
+        trace('rule', "Evaluating '{}'", rule)
         # Evaluate the predicates on the right-hand side of the rule
         relations = [self.evaluate_query(predicate) for predicate in rule.predicates]
 
@@ -65,20 +111,31 @@ class DatalogInterpreter(relational_database.RDBMS):
             new_rel = relations.pop()
             # Find
             common_columns = set(list(new_rel)) & set(list(relation))
-            logger.debug("Merge A:\n{}".format(relation))
-            logger.debug("Merge B:\n{}".format(new_rel))
-            if common_columns:
-                logger.debug("Relations share a common column: {}".format([str(x) for x in common_columns]))
+            trace('merge', lambda: "Merge A:\n{}".format(self.decode(relation)))
+            trace('merge', lambda: "Merge B:\n{}".format(self.decode(new_rel)))
+            if isinstance(relation, ColumnRelation) and not (relation.columns and new_rel.columns):
+                # The pandas engine cross joins with an outer merge, which keeps all of the rows of the other relation
+                # when one has no columns to be missing values in
+                relation = relation if relation.columns else new_rel
+            elif isinstance(relation, ColumnRelation):
+                # Joins on the common columns, or makes the cross product if there are none
+                relation = relation.join(new_rel)
+            elif common_columns:
+                trace('common_columns', lambda: "Relations share a common column: {}".format(
+                    [SYMBOLS[x] for x in common_columns]))
                 relation = pd.merge(relation, new_rel, how='inner').dropna()
             else:
-                logger.debug("Adding common column")
+                trace('cross_join', "Adding common column")
+                # The relations can be cached query results, so the column is added to copies
+                relation = relation.copy(deep=False)
+                new_rel = new_rel.copy(deep=False)
                 relation[self.merge_token] = 0
                 new_rel[self.merge_token] = 0
                 relation = pd.merge(relation, new_rel, how='outer').dropna()
                 relation = relation.drop(self.merge_token, axis=1)
-            logger.debug("Combined:\n{}".format(relation))
+            trace('combined', lambda: "Combined:\n{}".format(self.decode(relation)))
 
-        logger.debug("Joined:\n{}".format(relation))
+        trace('joined', lambda: "Joined:\n{}".format(self.decode(relation)))
 
         return relation
 
@@ -91,74 +148,61 @@ class DatalogInterpreter(relational_database.RDBMS):
         :param relation: A relation
         :return: True if the database increased in size, otherwise false
         """
-        logger.debug("Uniting based on '{}'".format(head))
-        size = len(self.relations.get(head.id, ""))
+        trace('union', "Uniting based on '{}'", head)
+        size = len(self.relations.get(head.id.symbol, ""))
         # Project columns that appear in head predicate
         # Rename relation to match the schema of the relation in the database
+        names = [x.symbol for x in head.idList]
         try:
-            relation = relation[[x for x in head.idList]]
-        except KeyError as e:
+            if isinstance(relation, ColumnRelation):
+                relation = relation.project([relation.names.index(name) for name in names])
+            else:
+                relation = relation[names]
+        except (KeyError, ValueError) as e:
             logger.warning(e)
             return False
-        logger.debug("Project:\n{}".format(relation))
-        relation.columns = range(relation.shape[1])
+        trace('project', lambda: "Project:\n{}".format(self.decode(relation)))
+        if isinstance(relation, ColumnRelation):
+            relation = relation.rename(range(len(names)))
+        else:
+            relation.columns = range(relation.shape[1])
 
         # Union with the relation in the database
-        if isinstance(self.relations.get(head.id, None), relational_database.Relation) and \
-                not self.relations[head.id].empty:
-            logger.debug("Adding to existing relation: {}".format(head.id))
-            relation = self.relations[head.id].append(relation).drop_duplicates()
+        existing = self.relations.get(head.id.symbol, None)
+        if isinstance(existing, self.relation_type) and not existing.empty:
+            trace('union', "Adding to existing relation: {}", head.id)
+            if isinstance(relation, ColumnRelation):
+                # The indexes of the relation are updated with the new rows
+                relation = existing.union(relation)
+            else:
+                relation = existing.append(relation).drop_duplicates()
+                if len(relation) == size and relation.equals(existing):
+                    relation = existing
         else:
-            logger.debug("Creeating new relation: {}".format(head.id))
-
-        self.relations[head.id] = relation
+            trace('union', "Creating new relation: {}", head.id)
+
+        if relation is not existing:
+            # Queries on the relation that were cached are answered again
+            self.relations[head.id.symbol] = relation
+            self.versions[head.id.symbol] = self.versions.get(head.id.symbol, 0) + 1
+            if isinstance(existing, self.relation_type) and not existing.empty:
+                # The rows of the existing relation come first, and only the new rows after them are counted
+                self.catalog.extend(head.id.symbol, relation, size)
+            else:
+                # The first rows united into a relation aren't checked for duplicates
+                self.catalog.count(head.id.symbol, relation, unique=False)
 
-        logger.debug("United:\n{}".format(self.relations[head.id]))
-        new_size = len(self.relations[head.id])
-        logger.debug("Added {} new items".format(new_size - size))
+        trace('united', lambda: "United:\n{}".format(self.decode(relation, named=False)))
+        new_size = len(self.relations[head.id.symbol])
+        trace('added', "Added {} new items", new_size - size)
         return bool(new_size - size)
 
-    def __str__(self) -> str:
+    def write_header(self, stream: TextIO):
         """
         This is the same as printing a relational database except we will also print the passes
-        :return:
         """
-        manager = multiprocessing.Manager()
-        results = manager.dict()
-        result = "Schemes populated after {} passes through the Rules.\n".format(self.passes)
-        jobs = []
-        for i, query in enumerate(self.rdbms.keys()):
-            p = multiprocessing.Process(target=self._str_worker, args=(i, query, results))
-            jobs.append(p)
-            p.start()
-        for proc in jobs:
-            proc.join()
-        for i, _ in enumerate(self.rdbms.keys()):
-            result += results[i]
-        return result
+        stream.write("Schemes populated after {} passes through the Rules.\n".format(self.passes))
 
 
 if __name__ == "__main__":
-    from argparse import ArgumentParser
-
-    arg = ArgumentParser(description="Run the datalog parser, this will produce output for lab 2")
-    arg.add_argument('-d', '--debug', help="The logging debug level to use", default=logging.NOTSET, metavar='LEVEL')
-    arg.add_argument('file', help='datalog file to parse')
-    args = arg.parse_args()
-
-    logging.basicConfig(level=logging.ERROR)
-    logger.setLevel(int(args.debug))
-
-    logger.info("Detected {} CPUs".format(multiprocessing.cpu_count()))
-    logger.debug("Parsing '%s'" % args.file)
-
-    # Create class objects
-    tokens = lexical_analyzer.scan(args.file)
-    datalog = None
-    try:
-        datalog = datalog_parser.DatalogProgram(tokens)
-    except TokenError as t:
-        print("Failure!\n  {}".format(t))
-        exit(1)
-
-    print(DatalogInterpreter(datalog))
+    relational_database.main(DatalogInterpreter, "Run the datalog parser, this will produce output for lab 2", logger)
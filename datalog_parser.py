@@ -1,242 +1,299 @@
 #!/usr/bin/env python3
-from typing import List
+from array import array
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
 
 import lexical_analyzer
 import logging
+import multiprocessing
+import numpy as np
+import re
+import tracing
 
-from tokens import TokenError, TokenType, Token
+from tokens import SYMBOLS, TokenBuffer, TokenError, TokenType, Token
+from tracing import Trace
 
 logger = logging.getLogger(__name__)
+trace = Trace(logger, 'parser')
 
-recent_token = None
 
+class Scheme:
+    """
+    The nodes of a parsed program only hold what was parsed, not how it was parsed.  Nothing changes a node once it is
+    created, the lists in a node are tuples.
+    """
+    __slots__ = ('id', 'idList')
 
-class Parser:
-    # All classes will read from this list of shared tokens until they are gone
-    unused_tokens = list()
-
-    # Share the most recently parsed token amongst all instances of this class
-    def __init__(self, grammar: List[Token] = None, tokens: List[Token] = None, root: bool = False, lazy: bool = False):
-        """
-        :param grammar: A list of tokens in the order they should be expected.
-        If the token is a list, then allow zero or more of the tokens in the list.
-        If the token is a set, then the match one of the objects in the set
-        If the token is a class, then return an instance of that class and continue parsing the remaining tokens
-        :param tokens: Only the base class should add tokens to the list of unused_tokens with this parameter.
-        unused_tokens are shared amongst all instances of the Parser class and its children
-        :param root: If This instance is the base, then any leftover tokens will be treated as an error
-
-        """
-        logger.debug("Matching {}to class '{}'".format("lazily " if lazy else "", self.__class__.__name__))
-        self.grammar = grammar if grammar is not None else self.grammar
-        if tokens is not None:
-            if root:
-                self.unused_tokens.clear()
-            self.unused_tokens.extend(tokens)
-        self.objects = self._parse_unused_tokens(lazy=lazy)
-
-        if root and self.unused_tokens:
-            raise TokenError(self.get_token())
-
-    def _parse_unused_tokens(self, grammar: List[Token] = None, lazy: bool = False) -> List[Token]:
-        """
-        :param grammar: The grammar to use, if none, then it will default to the class grammar
-        :param lazy: Don't raise any errors or remove from the list if the match fails
-        :return: The list of objects that matched the grammar
-        The list will contain instances of Token and Parser
-        """
-        global recent_token
-        if grammar is None:
-            grammar = self.grammar
-        objects = list()
-        for g in grammar:
-            if isinstance(g, TokenType):
-                t = self.get_token(lazy=lazy)
-                if t is None:
-                    return []
-                objects.append(t)
-                if not t.type == g:
-                    logger.debug("Token '{}' did not match '{}'".format(recent_token.type, g))
-                    if lazy:
-                        self.put_back_tokens(objects)
-                        return []
-                    else:
-                        raise TokenError(recent_token)
-                logger.debug("Matched {}".format(g))
-            elif isinstance(g, list):
-                logger.debug("Matching items in list for {}".format(self.__class__.__name__))
-                # keep matching in the list until something doesn't match
-                inner_list = self._parse_unused_tokens(lazy=True, grammar=g)
-                if not all(inner_list):
-                    return []
-                while inner_list:
-                    logger.debug("Checking for zero or more of {}".format([
-                        x.name if isinstance(x, TokenType) else x.__name__ for x in g
-                    ]))
-                    before = [str(x) for x in inner_list]
-                    objects.append(inner_list)
-                    inner_list = self._parse_unused_tokens(lazy=True, grammar=g)
-                    after = [str(x) for x in inner_list]
-                    #logger.debug("Inner list change: {}".format(diff(after, before)))
-                    if not all(inner_list):
-                        return []
-            elif isinstance(g, set):
-                logger.debug("Matching items in set for {}".format(self.__class__.__name__))
-                for s in g:
-                    set_match = self._parse_unused_tokens(lazy=True, grammar=[s])
-                    if set_match:
-                        objects.append(set_match[0])
-                        break
-
-            elif isinstance(g, type):
-                parser = g(lazy=lazy)
-                assert isinstance(parser, Parser)
-                objects.append(parser)
-                if not parser:
-                    logger.debug("{} creation failed at {}".format(self.__class__.__name__, g.__name__))
-                    if lazy:
-                        logger.debug("Returning {} tokens".format(g.__name__))
-                        self.put_back_tokens(objects)
-                        return []
-                    else:
-                        raise TokenError(recent_token)
-            else:
-                raise ValueError("Unrecognized type in grammar: %s" % g.__class__)
-        return objects
-
-    def put_back_tokens(self, objects):
-        before = "\n".join([str(i) for i in self.unused_tokens])
-        for o in reversed(objects):
-            if isinstance(o, Token):
-                self.unused_tokens.insert(0, o)
-            elif isinstance(o, Parser):
-                self.put_back_tokens(o.objects)
-        after = "\n".join([str(i) for i in self.unused_tokens])
-        #if before != after:
-        #    logger.debug("Put back Token: " + ColorDiff(after, before))
-
-    def get_token(self, lazy: bool = False) -> Token or None:
-        """
-        :return: The top token from the list
-        """
-        global recent_token
-        if self.unused_tokens:
-            recent_token = self.unused_tokens.pop(0)
-            assert isinstance(recent_token, Token)
-            return recent_token
-        elif lazy:
-            return None
-        else:
-            # If there are no more tokens then raise an error on the last token seen
-            raise TokenError(recent_token)
-
-
-class Scheme(Parser):
-    grammar = []
-
-    def __init__(self, lazy: bool = False):
-        super().__init__(lazy=lazy)
-
-        try:
-            self.id = self.objects[0]
-            self.idList = [self.objects[2]]
-        except IndexError:
-            self.id = None
-            self.idList = None
-            return
-
-        for o in self.objects[3:]:
-            if isinstance(o, list):
-                self.idList.extend([t for t in o if t.type == TokenType.ID])
+    def __init__(self, name: Token, ids: Iterable[Token]):
+        self.id = name
+        self.idList = tuple(ids)
 
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         return "{}({})".format(self.id.value, ",".join(t.value for t in self.idList))
 
-    def __bool__(self) -> bool:
-        return False if (self.id is None or self.idList is None) else True
-
 
-class Schemes(Parser):
-    def __init__(self, lazy=False):
-        super().__init__(lazy=lazy)
+class Schemes:
+    __slots__ = ('schemes',)
 
-        try:
-            self.schemes = [self.objects[0]]
-            for o in self.objects[1:]:
-                self.schemes += o
-        except IndexError:
-            self.schemes = None
-            return
+    def __init__(self, schemes: Iterable[Scheme]):
+        self.schemes = tuple(schemes)
 
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         return "Schemes({}):\n{}\n".format(len(self.schemes), "\n".join("  " + str(s) for s in self.schemes))
 
-    def __bool__(self) -> bool:
-        return False if self.schemes is None else True
-
 
 class Domain(set):
+    """
+    The symbols of every string in the facts
+    """
     def __str__(self) -> str:
         return "Domain({}):{}{}".format(
             len(self),
             "\n" if self else "",
-            "\n".join("  " + f.value for f in sorted(self)))
+            "\n".join("  " + value for value in sorted(SYMBOLS[s] for s in self)))
 
 
-class Fact(Parser):
-    grammar = []
+class Fact:
+    __slots__ = ('id', 'stringList')
 
-    def __init__(self, name: tuple = None, attributes: list = None, lazy: bool = False):
-        self.domain = Domain()
-        if name and attributes:
-            self.id = name
-            self.stringList = attributes
-        else:
-            super().__init__(lazy=lazy)
-            try:
-                self.id = self.objects[0]
-                self.stringList = [self.objects[2]]
-            except IndexError:
-                self.id = None
-                self.stringList = None
-                return
-
-            if self.stringList is not None:
-                for o in self.objects[3:]:
-                    if isinstance(o, list):
-                        self.stringList.extend([t for t in o if t.type == TokenType.STRING])
-
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
-
-        # Add facts to the domain
-        if self.stringList is not None:
-            for t in self.stringList:
-                if t.type == TokenType.STRING:
-                    self.domain.add(t)
+    def __init__(self, name: Token, attributes: Iterable[Token]):
+        self.id = name
+        self.stringList = tuple(attributes)
+
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         return "{}({}).".format(self.id.value, ",".join(t.value for t in self.stringList))
 
-    def __bool__(self) -> bool:
-        return False if (self.id is None or self.stringList is None) else True
 
+class Facts:
+    """
+    The facts are kept as a table of codes for each name, a code is the index of a string in the distinct strings of
+    the facts.  A code of -1 pads facts that have fewer strings than others with the same name.
+    Codes don't depend on the symbol table, so they can be pickled, while the columns and domain are symbols of this
+    process.
+    """
+    __slots__ = ('_facts', '_order', '_names', '_strings', '_codes', '_columns', '_domain')
 
-class Facts(Parser):
-    grammar = []
+    def __init__(self, facts: Iterable[Fact] = ()):
+        self.facts = list(facts)
 
-    def __init__(self, lazy: bool = True):
-        super().__init__(lazy=lazy)
-        try:
-            self.facts = [f[0] for f in self.objects]
-        except IndexError:
-            self.facts = None
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
+
+    @classmethod
+    def from_tokens(cls, tokens: TokenBuffer, begin: int, end: int) -> 'Facts':
+        """
+        Create the facts in a range of a TokenBuffer that only holds well formed facts, without a Fact for each of them
+        unless they are asked for.  The strings of the facts are read straight into tables of codes, and every distinct
+        string and name is a single token.  The Facts don't keep the buffer, the order of the names is enough to
+        recreate each Fact from the tables.
+        :param tokens: The buffer the facts were scanned into
+        :param begin: The index of the first token of the first fact
+        :param end: The index after the period of the last fact
+        """
+        facts = cls.__new__(cls)
+        facts._facts = None
+        facts._columns = None
+        facts._domain = None
+
+        codes = np.frombuffer(tokens.type_codes, dtype=np.uint8)[begin:end]
+        names = np.flatnonzero(codes == TokenBuffer.codes[TokenType.ID]) + begin
+        strings = np.flatnonzero(codes == TokenBuffer.codes[TokenType.STRING]) + begin
+        # Where the strings of each fact start in strings, and how many there are
+        first = np.searchsorted(strings, names)
+        arity = np.diff(np.append(first, len(strings)))
+
+        def column(values: array) -> np.ndarray:
+            return np.frombuffer(values, dtype=values.typecode)
+
+        source, starts, ends = tokens.source, column(tokens.starts), column(tokens.ends)
+        values = [source[start:stop] for start, stop in zip(starts[strings].tolist(), ends[strings].tolist())]
+        interned = dict()
+        codes = np.array([interned.setdefault(value, len(interned)) for value in values], dtype=np.int32)
+        _, first_use = np.unique(codes, return_index=True)
+        facts._strings = np.empty(len(interned), dtype=object)
+        facts._strings[:] = [
+            Token(line_number=line_number, value=value, t_type=TokenType.STRING, symbol=symbol)
+            for value, line_number, symbol in zip(
+                interned, column(tokens.line_numbers)[strings[first_use]].tolist(),
+                SYMBOLS.intern_all(list(interned)).tolist()
+            )
+        ]
+
+        name_values = [source[start:stop] for start, stop in zip(starts[names].tolist(), ends[names].tolist())]
+        groups = OrderedDict()
+        name_codes = np.array([groups.setdefault(name, len(groups)) for name in name_values], dtype=np.int64)
+        by_name = np.split(np.argsort(name_codes, kind='mergesort'), np.cumsum(np.bincount(name_codes))[:-1])
+        facts._order = name_codes.astype(np.uint32)
+        facts._names = [tokens.token(names[members[0]]) for members in by_name[:len(groups)]]
+        facts._codes = OrderedDict()
+        for name, members in zip(groups, by_name):
+            width = np.arange(arity[members].max())
+            missing = width >= arity[members, None]
+            table = codes[np.where(missing, 0, first[members, None] + width)]
+            table[missing] = -1
+            facts._codes[name] = table
+
+        trace('created', "Created {} facts about {} names in bulk", len(names), len(groups))
+        return facts
+
+    def _encode(self):
+        """
+        Make the tables of codes of facts that were created one at a time, and the order of their names
+        """
+        if self._codes is not None:
             return
+        interned, strings, rows, name_codes, names, order = dict(), [], OrderedDict(), dict(), [], []
+        for fact in self.facts:
+            codes = []
+            for s in fact.stringList:
+                code = interned.get(s.value)
+                if code is None:
+                    code = interned[s.value] = len(strings)
+                    strings.append(s)
+                codes.append(code)
+            rows.setdefault(fact.id.value, []).append(codes)
+            name_code = name_codes.get(fact.id.value)
+            if name_code is None:
+                name_code = name_codes[fact.id.value] = len(names)
+                names.append(fact.id)
+            order.append(name_code)
+        self._strings = np.empty(len(strings), dtype=object)
+        self._strings[:] = strings
+        self._order = np.array(order, dtype=np.uint32)
+        self._names = names
+        self._codes = OrderedDict()
+        for name, code_lists in rows.items():
+            table = np.full((len(code_lists), max(len(c) for c in code_lists)), -1, dtype=np.int32)
+            for i, code_list in enumerate(code_lists):
+                table[i, :len(code_list)] = code_list
+            self._codes[name] = table
+
+    @classmethod
+    def merge(cls, facts: Sequence['Facts']) -> 'Facts':
+        """
+        Merge the facts of many programs in order, keeping only the first of facts that are the same.
+        The facts are merged as rows of codes, without creating a Fact for each of them.
+        """
+        merged = cls.__new__(cls)
+        merged._facts = None
+        merged._columns = None
+        merged._domain = None
+
+        for f in facts:
+            f._encode()
+        # Strings are the same if they have the same symbol
+        strings = np.concatenate([f._strings for f in facts]) if facts else np.empty(0, dtype=object)
+        _, first, string_codes = np.unique(
+            np.fromiter((s.symbol for s in strings), dtype=np.int64, count=len(strings)),
+            return_index=True, return_inverse=True
+        )
+        strings = strings[first]
+        names, name_codes, blocks, start = [], dict(), [], 0
+        for f in facts:
+            string_map = np.append(string_codes[start:start + len(f._strings)], -1).astype(np.int32)
+            start += len(f._strings)
+            name_map = []
+            for name in f._names:
+                code = name_codes.get(name.value)
+                if code is None:
+                    code = name_codes[name.value] = len(names)
+                    names.append(name)
+                name_map.append(code)
+            order = f._order.astype(np.int64)
+            # The facts of each name, in the same order as the rows of its table
+            by_name = np.split(np.argsort(order, kind='mergesort'), np.cumsum(np.bincount(order))[:-1])
+            rows = np.full((len(order), max((t.shape[1] for t in f._codes.values()), default=0)), -1, dtype=np.int32)
+            for name, members in zip(f._names, by_name):
+                table = f._codes[name.value]
+                rows[members, :table.shape[1]] = string_map[table]
+            blocks.append((np.array(name_map, dtype=np.int32)[order], rows))
+
+        width = max((rows.shape[1] for _, rows in blocks), default=0)
+        table = np.full((sum(len(rows) for _, rows in blocks), 1 + width), -1, dtype=np.int32)
+        start = 0
+        for name_column, rows in blocks:
+            table[start:start + len(rows), 0] = name_column
+            table[start:start + len(rows), 1:1 + rows.shape[1]] = rows
+            start += len(rows)
+        # Number each distinct row by folding in one column at a time, and keep the first row with each number
+        key = table[:, 0].astype(np.int64)
+        for column in table[:, 1:].T:
+            _, key = np.unique(key * (len(strings) + 1) + column + 1, return_inverse=True)
+        _, first = np.unique(key, return_index=True)
+        table = table[np.sort(first)]
+
+        merged._strings = strings
+        merged._order = table[:, 0].astype(np.uint32)
+        merged._names = names
+        merged._codes = OrderedDict()
+        order = table[:, 0].astype(np.int64)
+        by_name = np.split(np.argsort(order, kind='mergesort'), np.cumsum(np.bincount(order))[:-1])
+        for name, members in zip(names, by_name):
+            rows = table[members, 1:]
+            merged._codes[name.value] = rows[:, :(rows >= 0).sum(axis=1).max()]
+
+        trace('merged', "Merged {} facts into {}", start, len(table))
+        return merged
+
+    @property
+    def facts(self) -> List[Fact]:
+        if self._facts is None and self._order is not None:
+            strings = self._strings.tolist()
+            tables = [self._codes[name.value].tolist() for name in self._names]
+            rows = [0] * len(tables)
+            self._facts = []
+            for code in self._order.tolist():
+                row = tables[code][rows[code]]
+                rows[code] += 1
+                self._facts.append(Fact(self._names[code], [strings[c] for c in row if c >= 0]))
+        return self._facts
+
+    @facts.setter
+    def facts(self, facts: List[Fact]):
+        self._facts = facts
+        self._order = None
+        self._names = None
+        self._strings = None
+        self._codes = None
+        self._columns = None
+        self._domain = None
+
+    @property
+    def columns(self) -> Dict[str, Tuple[np.ndarray, ...]]:
+        """
+        :return: The symbols of the strings of the facts with each name, as a tuple of columns in the order of the
+        facts.  Facts with fewer strings than others with the same name are padded with -1
+        """
+        if self._columns is None:
+            self._encode()
+            lookup = np.array([s.symbol for s in self._strings] + [-1], dtype=np.int64)
+            self._columns = OrderedDict((name, tuple(lookup[table].T)) for name, table in self._codes.items())
+        return self._columns
+
+    @property
+    def domain(self) -> Domain:
+        """
+        :return: The symbol of every string in the facts
+        """
+        if self._domain is None:
+            self._encode()
+            self._domain = Domain(s.symbol for s in self._strings)
+        return self._domain
+
+    def __getstate__(self) -> dict:
+        return {name: getattr(self, name) for name in ('_facts', '_order', '_names', '_strings', '_codes')}
 
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+    def __setstate__(self, state: dict):
+        self._columns = None
+        self._domain = None
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __str__(self) -> str:
         return "Facts({}):{}{}".format(
@@ -245,54 +302,31 @@ class Facts(Parser):
             "\n".join("  " + str(fact) for fact in self.facts)
         )
 
-    def __bool__(self) -> bool:
-        return False if (self.facts is None) else True
-
 
-class Expression(Parser):
-    grammar = []
+class Expression:
+    __slots__ = ('param_1', 'operator', 'param_2')
 
-    def __init__(self, lazy: bool = False):
-        # To avoid a circular dependency, this grammar needs to be defined in Init
-        super().__init__(lazy=lazy)
-        try:
-            self.param_1 = self.objects[1]
-            self.operator = self.objects[2]
-            self.param_2 = self.objects[3]
-        except IndexError:
-            self.param_1 = None
-            self.operator = None
-            self.param_2 = None
-            return
+    def __init__(self, param_1: 'Parameter', operator: Token or None, param_2: 'Parameter'):
+        self.param_1 = param_1
+        self.operator = operator
+        self.param_2 = param_2
 
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
-        return "({}{}{})".format(str(self.param_1), self.operator.value, str(self.param_2))
-
-    def __bool__(self) -> bool:
-        return False if (self.param_1 is None or self.operator is None or self.param_2 is None) else True
+        # An expression without an operator is parsed, and then ignored when the query is compiled
+        operator = self.operator.value if self.operator is not None else ""
+        return "({}{}{})".format(str(self.param_1), operator, str(self.param_2))
 
 
-class Parameter(Parser):
-    grammar = []
+class Parameter:
+    __slots__ = ('string_id', 'expression')
 
-    def __init__(self, lazy: bool = False):
-        super().__init__(lazy=lazy)
-        try:
-            o = self.objects[0]
-            if isinstance(o, Expression):
-                self.string_id = None
-                self.expression = o
-            else:
-                self.string_id = o
-                self.expression = None
-        except IndexError:
-            self.string_id = None
-            self.expression = None
-            return
+    def __init__(self, string_id: Token = None, expression: Expression = None):
+        self.string_id = string_id
+        self.expression = expression
 
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         if self.string_id is not None:
@@ -300,9 +334,6 @@ class Parameter(Parser):
         else:
             return str(self.expression)
 
-    def __bool__(self) -> bool:
-        return False if (self.string_id is None and self.expression is None) else True
-
     def __gt__(self, other) -> bool:
         return str(self) > str(other)
 
@@ -310,133 +341,135 @@ class Parameter(Parser):
 headPredicate = Scheme
 
 
-class Predicate(Parser):
-    grammar = []
-
-    def __init__(self, lazy: bool = False):
-        super().__init__(lazy=lazy)
-        try:
-            self.id = self.objects[0]
-            self.parameterList = [self.objects[2]]
-            # Only compute this once to save time
-        except IndexError:
-            self.id = None
-            self.parameterList = None
-            return
+class Predicate:
+    """
+    Predicates hash the same as any predicate that prints the same, so that queries can be used as keys in lab 3.
+    They are only equal to themselves, a query that is asked twice is answered twice.
+    """
+    __slots__ = ('id', 'parameterList', 'hash')
 
-        for o in self.objects[3:]:
-            if isinstance(o, list):
-                self.parameterList.append(o[1])
+    def __init__(self, name: Token, parameters: Iterable[Parameter]):
+        self.id = name
+        self.parameterList = tuple(parameters)
+        # Only compute this once to save time
         self.hash = hash(str(self))
 
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         return "{}({})".format(self.id.value, ",".join(str(p) for p in self.parameterList))
 
     def __hash__(self) -> int:
-        """
-        This is necessary if we want to use queries as a key in lab 3
-        :return: The hashed form of the string representation of this class
-        """
         return self.hash
 
-    def __bool__(self) -> bool:
-        return False if (self.id is None or self.parameterList is None) else True
 
+class Rule:
+    __slots__ = ('head', 'predicates')
 
-class Rule(Parser):
-    grammar = []
+    def __init__(self, head: headPredicate, predicates: Iterable[Predicate]):
+        self.head = head
+        self.predicates = tuple(predicates)
 
-    def __init__(self, lazy: bool = False, head: headPredicate = None, predicates: List[Predicate] = None):
-        if head is not None and predicates is not None:
-            self.head = head
-            self.predicates = predicates
-        else:
-            super().__init__(lazy=lazy)
-            try:
-                self.head = self.objects[0]
-                self.predicates = [self.objects[2]]
-                self.predicates += [o[1] for o in self.objects[3:] if isinstance(o, list)]
-            except IndexError:
-                self.head = None
-                self.predicates = None
-                return
-
-            logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         return "{} :- {}.".format(str(self.head), ",".join(str(p) for p in self.predicates))
 
-    def __bool__(self) -> bool:
-        return False if (self.head is None or self.predicates is None) else True
 
+class Rules:
+    __slots__ = ('rules',)
 
-class Rules(Parser):
-    grammar = []
+    def __init__(self, rules: Iterable[Rule] = ()):
+        self.rules = tuple(rules)
 
-    def __init__(self, lazy: bool = False):
-        # Rule creation is always lazy because there can be 0
-        super().__init__(lazy=lazy)
-        try:
-            self.rules = [o[0] for o in self.objects]
-        except IndexError:
-            self.rules = []
-
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         return "Rules({}):{}{}".format(
             len(self.rules), '\n' if self.rules else '', "\n".join("  " + str(r) for r in self.rules)
         )
 
-    def __bool__(self) -> bool:
-        return True
-
 
 Query = Predicate
 
 
-class Queries(Parser):
-    grammar = []
+class Queries:
+    __slots__ = ('queries',)
 
-    def __init__(self, lazy: bool = False):
-        super().__init__(lazy=lazy)
-        try:
-            self.queries = [self.objects[0]]
-            self.queries += [o[0] for o in self.objects[2:]]
-        except IndexError:
-            self.queries = None
-            return
-        logger.debug("Created {}: {}".format(self.__class__.__name__, str(self)))
+    def __init__(self, queries: Iterable[Query]):
+        self.queries = tuple(queries)
+
+        trace('created', "Created {}: {}", self.__class__.__name__, self)
 
     def __str__(self) -> str:
         return "Queries({}):\n{}".format(len(self.queries), "\n".join("  " + str(q) + "?" for q in self.queries))
 
-    def __bool__(self) -> bool:
-        return False if self.queries is None else True
 
+class DatalogProgram:
+    __slots__ = ('schemes', 'facts', 'rules', 'queries')
 
-class DatalogProgram(Parser):
-    grammar = []
-
-    def __init__(self, lex_tokens: list):
-        # Clear the domain from a previous run
-        super().__init__(tokens=lex_tokens, root=True)
-        self.schemes = self.objects[2]
-        self.facts = self.objects[5]
-        self.rules = self.objects[8]
-        self.queries = self.objects[11]
-        self.domain = Domain()
-        for fact in self.facts.facts:
-            self.domain |= fact.domain
+    def __init__(self, lex_tokens: Iterable[Token] = None, schemes: Schemes = None, facts: Facts = None,
+                 rules: Rules = None, queries: Queries = None):
+        """
+        :param lex_tokens: The tokens to parse the program from
+        The sections of a program that is already parsed can be given instead of tokens
+        """
+        if lex_tokens is not None:
+            schemes, facts, rules, queries = PredictiveParser(lex_tokens).parse()
+        self.schemes = schemes
+        self.facts = facts
+        self.rules = rules
+        self.queries = queries
+
+    @property
+    def domain(self) -> Domain:
+        return self.facts.domain
+
+    @classmethod
+    def merge(cls, programs: Iterable['DatalogProgram'], workers: int = None) -> 'DatalogProgram':
+        """
+        Merge many programs into one with a tree reduction, merging groups of programs at the same time and then
+        merging the results until there is one program left
+        :param programs: The programs to merge, in order
+        :param workers: The number of groups to merge at once, defaults to the number of CPUs
+        :return: The programs merged by _merge
+        """
+        programs = list(programs)
+        workers = workers or multiprocessing.cpu_count()
+        if len(programs) <= 2 or workers == 1:
+            return cls._merge(programs)
+        with ThreadPool(workers) as pool:
+            while len(programs) > 1:
+                size = max(2, -(-len(programs) // workers))
+                programs = pool.map(cls._merge, [programs[i:i + size] for i in range(0, len(programs), size)])
+        return programs[0]
+
+    @classmethod
+    def _merge(cls, programs: Sequence['DatalogProgram']) -> 'DatalogProgram':
+        """
+        Merge programs in order, only keeping the first of anything that is in more than one of them.
+        Facts are the same if they have the same strings, and rules and queries if they print the same.
+        Schemes with the same name are reconciled to the first of them.
+        """
+        schemes, rules, queries = OrderedDict(), OrderedDict(), OrderedDict()
+        for program in programs:
+            for scheme in program.schemes.schemes:
+                kept = schemes.setdefault(scheme.id.value, scheme)
+                if len(kept.idList) != len(scheme.idList):
+                    logger.warning("Keeping the scheme {} instead of {}".format(kept, scheme))
+            for rule in program.rules.rules:
+                rules.setdefault(str(rule), rule)
+            for query in program.queries.queries:
+                queries.setdefault(str(query), query)
+        return cls(
+            schemes=Schemes(schemes.values()),
+            facts=Facts.merge([program.facts for program in programs]),
+            rules=Rules(rules.values()),
+            queries=Queries(queries.values()),
+        )
 
-    def __add__(self, other) -> Parser:
-        self.schemes.schemes += other.schemes.schemes
-        self.facts.facts += other.facts.facts
-        self.rules.rules += other.rules.rules
-        self.queries.queries += other.queries.queries
-        return self
+    def __add__(self, other) -> 'DatalogProgram':
+        return DatalogProgram.merge([self, other])
 
     def print_datalog_file(self)->str:
         return 'Schemes:\n  {}\nFacts:\n  {}\nRules:\n  {}\nQueries:\n  {}'.format(
@@ -456,105 +489,212 @@ class DatalogProgram(Parser):
         )
 
 
-DatalogProgram.grammar = [
-    TokenType.SCHEMES, TokenType.COLON, Schemes,
-    TokenType.FACTS, TokenType.COLON, Facts,
-    TokenType.RULES, TokenType.COLON, Rules,
-    TokenType.QUERIES, TokenType.COLON, Queries,
-    TokenType.EOF
-]
-
-Schemes.grammar = [
-    Scheme,
-    [
-        Scheme
-    ]
-]
-
-Scheme.grammar = [
-    TokenType.ID,
-    TokenType.LEFT_PAREN,
-    TokenType.ID,
-    [
-        TokenType.COMMA,
-        TokenType.ID
-    ],
-    TokenType.RIGHT_PAREN
-]
-
-Facts.grammar = [
-    [
-        Fact
-    ]
-]
-
-Fact.grammar = [
-    TokenType.ID,
-    TokenType.LEFT_PAREN,
-    TokenType.STRING,
-    [
-        TokenType.COMMA,
-        TokenType.STRING
-    ],
-    TokenType.RIGHT_PAREN,
-    TokenType.PERIOD
-]
-
-Rules.grammar = [
-    [
-        Rule
-    ]
-]
-
-Rule.grammar = [
-    headPredicate,
-    TokenType.COLON_DASH,
-    Predicate,
-    [
-        TokenType.COMMA,
-        Predicate
-    ],
-    TokenType.PERIOD,
-]
-
-Queries.grammar = [
-    Query,
-    TokenType.Q_MARK,
-    [
-        Query,
-        TokenType.Q_MARK
-    ]
-]
-
-Predicate.grammar = [
-    TokenType.ID,
-    TokenType.LEFT_PAREN,
-    Parameter,
-    [
-        TokenType.COMMA,
-        Parameter
-    ],
-    TokenType.RIGHT_PAREN
-]
-
-Parameter.grammar = [
-    {
-        TokenType.STRING,
-        TokenType.ID,
-        Expression
-    }
-]
-
-Expression.grammar = [
-    TokenType.LEFT_PAREN,
-    Parameter,
-    {
-        TokenType.ADD,
-        TokenType.MULTIPLY
-    },
-    Parameter,
-    TokenType.RIGHT_PAREN
-]
+class _Backtrack(Exception):
+    """
+    A lazy match failed, the attempt that started it moves the cursor back to where it began
+    """
+    pass
+
+
+class PredictiveParser:
+    """
+    Parse a datalog program by predicting each part of the grammar from the next token.  The grammar, where {x} is zero
+    or more of x, [x] is an optional x and | separates the alternatives, is:
+
+        datalogProgram  SCHEMES COLON scheme {scheme} FACTS COLON {fact} RULES COLON {rule}
+                        QUERIES COLON predicate Q_MARK {predicate Q_MARK} EOF
+        scheme          ID LEFT_PAREN ID {COMMA ID} RIGHT_PAREN
+        fact            ID LEFT_PAREN STRING {COMMA STRING} RIGHT_PAREN PERIOD
+        rule            scheme COLON_DASH predicate {COMMA predicate} PERIOD
+        predicate       ID LEFT_PAREN parameter {COMMA parameter} RIGHT_PAREN
+        parameter       STRING | ID | expression
+        expression      LEFT_PAREN parameter [ADD | MULTIPLY] parameter RIGHT_PAREN
+
+    Tokens are read with a cursor, and the nodes of the program are built straight from the tokens without a parse
+    tree.  The cursor is the only state of a parse, so any number of programs can be parsed at the same time.  Each
+    of zero or more repetitions is matched lazily: one that fails part way through moves the cursor back to its first
+    token, and the error is reported by whatever is expected after the repetition.
+    """
+    # Any number of well formed facts, matched against the type codes of a TokenBuffer all at once
+    FACTS = re.compile(b"(?:%(ID)s%(LEFT_PAREN)s%(STRING)s(?:%(COMMA)s%(STRING)s)*%(RIGHT_PAREN)s%(PERIOD)s)*" % {
+        t.name.encode(): re.escape(bytes([TokenBuffer.codes[t]])) for t in TokenType
+    })
+
+    def __init__(self, tokens: Iterable[Token]):
+        """
+        :param tokens: Any iterable of tokens ending with EOF, a TokenBuffer is read in place
+        """
+        self.tokens = tokens if isinstance(tokens, Sequence) else list(tokens)
+        self.end = len(self.tokens)
+        if isinstance(self.tokens, TokenBuffer):
+            # Only create the tokens that end up in the parsed objects
+            self.type_at = self.tokens.type
+            self.token_at = self.tokens.token
+        else:
+            self.type_at = lambda i: self.tokens[i].type
+            self.token_at = self.tokens.__getitem__
+        self.position = 0
+        # The last token that was looked at, this is the token reported when parsing fails
+        self.recent = None
+
+    def parse(self) -> Tuple[Schemes, Facts, Rules, Queries]:
+        """
+        :return: The sections of the program matched by datalogProgram
+        """
+        self.expect(TokenType.SCHEMES)
+        self.expect(TokenType.COLON)
+        schemes = self.schemes()
+        self.expect(TokenType.FACTS)
+        self.expect(TokenType.COLON)
+        facts = self.facts()
+        self.expect(TokenType.RULES)
+        self.expect(TokenType.COLON)
+        rules = self.rules()
+        self.expect(TokenType.QUERIES)
+        self.expect(TokenType.COLON)
+        queries = self.queries()
+        self.expect(TokenType.EOF)
+        if self.position < self.end:
+            raise TokenError(self.token_at(self.position))
+        return schemes, facts, rules, queries
+
+    def peek(self) -> TokenType or None:
+        """
+        :return: The type of the token at the cursor, or None if there are no more tokens
+        """
+        if self.position < self.end:
+            self.recent = self.position
+            return self.type_at(self.position)
+        return None
+
+    def fail(self, lazy: bool):
+        if lazy:
+            raise _Backtrack()
+        raise TokenError(self.token_at(self.recent) if self.recent is not None else None)
+
+    def expect(self, t_type: TokenType, lazy: bool = False) -> Token:
+        if self.peek() is not t_type:
+            self.fail(lazy)
+        self.position += 1
+        return self.token_at(self.position - 1)
+
+    def repeat(self, *grammar) -> List[list]:
+        """
+        Match zero or more of a sequence of token types and parsing methods.
+        Another repetition is only attempted if the next token can start one, every nonterminal that repeats starts
+        with an ID.
+        :return: A list of the objects in each repetition
+        """
+        first = grammar[0] if isinstance(grammar[0], TokenType) else TokenType.ID
+        repetitions = []
+        while self.peek() is first:
+            start = self.position
+            try:
+                repetitions.append([self.expect(g, True) if isinstance(g, TokenType) else g(True) for g in grammar])
+            except _Backtrack:
+                self.position = start
+                break
+        return repetitions
+
+    def schemes(self, lazy: bool = False) -> Schemes:
+        return Schemes([self.scheme(lazy)] + [s for s, in self.repeat(self.scheme)])
+
+    def scheme(self, lazy: bool = False) -> Scheme:
+        name = self.expect(TokenType.ID, lazy)
+        self.expect(TokenType.LEFT_PAREN, lazy)
+        ids = [self.expect(TokenType.ID, lazy)] + [t for _, t in self.repeat(TokenType.COMMA, TokenType.ID)]
+        self.expect(TokenType.RIGHT_PAREN, lazy)
+        return Scheme(name, ids)
+
+    def facts(self, lazy: bool = False) -> Facts:
+        if isinstance(self.tokens, TokenBuffer):
+            end = self.FACTS.match(self.tokens.type_codes, self.position).end()
+            if end < self.end and self.type_at(end) is TokenType.RULES:
+                facts = Facts.from_tokens(self.tokens, self.position, end)
+                self.position = end
+                return facts
+            # There is a syntax error, which is reported the same way as ever by parsing one fact at a time
+        return Facts([f for f, in self.repeat(self.fact)])
+
+    def fact(self, lazy: bool = False) -> Fact:
+        name = self.expect(TokenType.ID, lazy)
+        self.expect(TokenType.LEFT_PAREN, lazy)
+        strings = [self.expect(TokenType.STRING, lazy)] + [
+            t for _, t in self.repeat(TokenType.COMMA, TokenType.STRING)
+        ]
+        self.expect(TokenType.RIGHT_PAREN, lazy)
+        self.expect(TokenType.PERIOD, lazy)
+        return Fact(name, strings)
+
+    def rules(self, lazy: bool = False) -> Rules:
+        return Rules([r for r, in self.repeat(self.rule)])
+
+    def rule(self, lazy: bool = False) -> Rule:
+        head = self.scheme(lazy)
+        self.expect(TokenType.COLON_DASH, lazy)
+        predicates = [self.predicate(lazy)] + [p for _, p in self.repeat(TokenType.COMMA, self.predicate)]
+        self.expect(TokenType.PERIOD, lazy)
+        return Rule(head, predicates)
+
+    def queries(self, lazy: bool = False) -> Queries:
+        queries = [self.predicate(lazy)]
+        self.expect(TokenType.Q_MARK, lazy)
+        return Queries(queries + [q for q, _ in self.repeat(self.predicate, TokenType.Q_MARK)])
+
+    def predicate(self, lazy: bool = False) -> Predicate:
+        name = self.expect(TokenType.ID, lazy)
+        self.expect(TokenType.LEFT_PAREN, lazy)
+        parameters = [self.parameter(lazy)] + [p for _, p in self.repeat(TokenType.COMMA, self.parameter)]
+        self.expect(TokenType.RIGHT_PAREN, lazy)
+        return Predicate(name, parameters)
+
+    def parameter(self, lazy: bool = False) -> Parameter:
+        t_type = self.peek()
+        if t_type is TokenType.STRING or t_type is TokenType.ID:
+            self.position += 1
+            return Parameter(string_id=self.token_at(self.position - 1))
+        if t_type is TokenType.LEFT_PAREN:
+            start = self.position
+            try:
+                return Parameter(expression=self.expression(True))
+            except _Backtrack:
+                # A failed expression is reported on the LEFT_PAREN that opens it, not on the token it failed on
+                self.position = start
+                self.recent = start
+        self.fail(lazy)
+
+    def expression(self, lazy: bool = False) -> Expression:
+        self.expect(TokenType.LEFT_PAREN, lazy)
+        param_1 = self.parameter(lazy)
+        # Like the grammar's set of operators, nothing matching it is not an error by itself
+        operator = None
+        if self.peek() in (TokenType.ADD, TokenType.MULTIPLY):
+            operator = self.expect(self.type_at(self.position))
+        param_2 = self.parameter(lazy)
+        self.expect(TokenType.RIGHT_PAREN, lazy)
+        return Expression(param_1, operator, param_2)
+
+
+def parse_many(datalog_files: Iterable[str], workers: int = None,
+               processes: bool = False) -> Iterator[DatalogProgram or TokenError]:
+    """
+    Parse many datalog files at the same time, every file in a parse of its own
+    :param datalog_files: The paths of the files to parse
+    :param workers: The number of files to parse at once, defaults to the number of CPUs
+    :param processes: Use a pool of processes instead of threads.  Threads share the interpreter lock, but processes
+    have to pickle each program to send it back
+    :return: The program parsed from each file, in the same order, or the TokenError that parsing it raised
+    """
+    pool_class = multiprocessing.Pool if processes else ThreadPool
+    with pool_class(workers or multiprocessing.cpu_count()) as pool:
+        yield from pool.imap(_parse_file, datalog_files)
+
+
+def _parse_file(datalog_file: str) -> DatalogProgram or TokenError:
+    try:
+        return DatalogProgram(lexical_analyzer.scan(datalog_file))
+    except TokenError as t:
+        return t
 
 
 if __name__ == "__main__":
@@ -571,6 +711,7 @@ if __name__ == "__main__":
 
     logging.basicConfig(level=logging.ERROR)
     logger.setLevel(int(args.debug))
+    tracing.configure()
 
     result = "Success!\n"
 
@@ -579,17 +720,17 @@ if __name__ == "__main__":
 
     logger.info("Running test on lab 2 part {}".format(part))
 
-    tokens = lexical_analyzer.scan(args.file)
-
     if args.debug:
-        # Print out traces on token errors
-        datalog = DatalogProgram(tokens)
+        # Print out traces on token errors, parsing the file again so that there are traces
+        datalog = DatalogProgram(lexical_analyzer.scan_iter(args.file))
         if part == 2:
             result += str(datalog)
     else:
+        import parse_cache
+
         # Ignore traces on token errors
         try:
-            datalog = DatalogProgram(tokens)
+            datalog = parse_cache.parse(args.file)
             result += str(datalog)
         except TokenError as t:
             result = 'Failure!\n'
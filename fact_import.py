@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import csv
+import logging
+
+from itertools import islice
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from tokens import SYMBOLS
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+trace = Trace(logger, 'import')
+
+# The number of rows that are read and interned at a time, only the symbols of the rows are kept after that
+CHUNK_SIZE = 1 << 16
+# Files with these extensions are tab separated and don't quote their values, anything else is a CSV file
+TSV_EXTENSIONS = ('.tsv', '.tab')
+# The number of bytes of a file that are read at a time to count its lines
+BLOCK_SIZE = 1 << 20
+
+
+def quote(value: str) -> str:
+    """
+    :return: The value as the text of a datalog string, which is how the strings of parsed facts are interned
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def intern_values(values: Sequence[str]) -> np.ndarray:
+    """
+    Each different value is only quoted and interned once
+    :return: The symbol of each value as a datalog string
+    """
+    unique = dict.fromkeys(values)
+    lookup = dict(zip(unique, SYMBOLS.intern_all([quote(value) for value in unique]).tolist()))
+    return np.fromiter(map(lookup.__getitem__, values), dtype=np.int64, count=len(values))
+
+
+def scheme_file(argument: str) -> Tuple[str, str]:
+    """
+    :param argument: The name of a scheme and a file separated by '=', as it is given on the command line
+    :return: The name of the scheme and the file
+    """
+    name, separator, fact_file = argument.partition('=')
+    if not (name and separator and fact_file):
+        raise ValueError("Expected SCHEME=FILE, not '{}'".format(argument))
+    return name, fact_file
+
+
+def read_facts(fact_file: str, arity: int, delimiter: str = None, header: bool = False,
+               chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, ...]]:
+    """
+    Read the rows of a CSV or TSV file as facts, chunk_size rows at a time.  Blank lines are skipped.
+    :param arity: The number of values that every row must have, the number of attributes of its scheme
+    :param delimiter: The character between values, which is a tab for files with TSV_EXTENSIONS and a comma otherwise
+    :param header: If the first row names the columns rather than being a fact
+    :return: The symbols of each chunk of rows, as a tuple of columns
+    :raises ValueError: If a row has the wrong number of values
+    """
+    if delimiter is None:
+        delimiter = '\t' if fact_file.lower().endswith(TSV_EXTENSIONS) else ','
+    quoting = csv.QUOTE_NONE if delimiter == '\t' else csv.QUOTE_MINIMAL
+    with open(fact_file, newline='', encoding='utf-8') as fact_stream:
+        reader = csv.reader(fact_stream, delimiter=delimiter, quoting=quoting)
+        if header:
+            next(reader, None)
+        read = 0
+        while True:
+            rows = list(islice(reader, chunk_size))  # type: List[List[str]]
+            if not rows:
+                return
+            for i, row in enumerate(rows):
+                if row and len(row) != arity:
+                    raise ValueError("{}: row {} has {} values, expected {}".format(
+                        fact_file, read + i + 1 + header, len(row), arity))
+            read += len(rows)
+            rows = [row for row in rows if row]
+            trace('chunk', "Read {} rows of {}", read, fact_file)
+            if rows:
+                yield tuple(intern_values(column) for column in zip(*rows))
+
+
+def count_lines(fact_file: str) -> int:
+    """
+    :return: The number of lines in a file, which is at least the number of rows in it unless its lines end in '\\r'
+    """
+    lines = 1
+    with open(fact_file, 'rb') as fact_stream:
+        for block in iter(lambda: fact_stream.read(BLOCK_SIZE), b''):
+            lines += block.count(b'\n')
+    return lines
+
+
+def read_columns(fact_file: str, arity: int, delimiter: str = None, header: bool = False,
+                 chunk_size: int = CHUNK_SIZE) -> Tuple[np.ndarray, ...]:
+    """
+    Read all of the rows of a CSV or TSV file as facts into columns that are allocated once for every line of the file,
+    and filled a chunk of rows at a time, so the file only takes the memory of its symbols and one chunk of rows.
+    Lines that aren't rows, like blank lines, are left over at the end of the columns
+    :param arity: The number of values that every row must have, the number of attributes of its scheme
+    :return: The symbols of the rows, as a tuple of columns
+    :raises ValueError: If a row has the wrong number of values
+    """
+    columns = [np.empty(count_lines(fact_file), dtype=np.int64) for _ in range(arity)]
+    rows = 0
+    for chunk in read_facts(fact_file, arity, delimiter=delimiter, header=header, chunk_size=chunk_size):
+        end = rows + len(chunk[0])
+        if end > len(columns[0]):
+            # Lines that end in '\r' alone aren't counted, so the columns grow like a list
+            columns = [np.concatenate((column[:rows], np.empty(max(end, 2 * rows) - rows, dtype=np.int64)))
+                       for column in columns]
+        for column, values in zip(columns, chunk):
+            column[rows:end] = values
+        rows = end
+    return tuple(column[:rows] for column in columns)
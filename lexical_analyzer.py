@@ -1,53 +1,251 @@
 #!/usr/bin/env python3
 import logging
+import multiprocessing
+import tracing
 
+from bisect import bisect_left, bisect_right
+from io import StringIO
 from os import path
 
-from tokens import Token, TokenType
-from typing import List
+from tokens import Token, TokenBuffer, TokenType, TOKEN_PATTERN
+from tracing import Trace, TRACE
+from typing import Callable, Iterator
 
 logger = logging.getLogger("Lexical Analyzer")
+trace = Trace(logger, 'lexer')
 
 
-def scan(datalog_file: str = None, ignore_whitespace: bool =True, ignore_comments: bool=True, input_data: str = None) -> List[Token]:
+# Number of characters read from the datalog file at a time by scan_iter
+CHUNK_SIZE = 1 << 16
+# Inputs are split into pieces of about this many characters for scan_parallel
+PARALLEL_CHUNK_SIZE = 1 << 22
+
+
+def scan(datalog_file: str = None, ignore_whitespace: bool = True, ignore_comments: bool = True,
+         input_data: str = None) -> TokenBuffer:
     """
     :param ignore_comments: 
     :param ignore_whitespace:
     :param datalog_file: The example datalog file being parsed
-    :return: a list of tokens
+    :return: a compact sequence of tokens
+    """
+    file_string = ""
+    if input_data is None and path.exists(str(datalog_file)):
+        with open(datalog_file) as datalog_file_stream:
+            file_string = datalog_file_stream.read()
+    elif input_data is not None:
+        file_string = input_data
+
+    tokens = TokenBuffer(file_string)
+    _, line_number = _scan_into(tokens, 0, 1, ignore_whitespace, ignore_comments)
+    trace('eof', "Adding EOF Token at line {}", line_number)
+    tokens.append(TokenType.EOF, len(file_string), len(file_string), line_number)
+    return tokens
+
+
+def scan_iter(datalog_file: str = None, ignore_whitespace: bool = True, ignore_comments: bool = True,
+              input_data: str = None, chunk_size: int = CHUNK_SIZE) -> Iterator[Token]:
+    """
+    Lazily produce the same tokens as scan while only holding a chunk of the file in memory at a time.
+    A match that reaches the end of the buffer could continue in the next chunk (block comments, strings, IDs,
+    whitespace, a ':' before a '-'...) so it is only trusted once more of the file has been read, or there is no more.
+    :param ignore_comments:
+    :param ignore_whitespace:
+    :param datalog_file: The example datalog file being parsed
+    :param input_data: Scan this string instead of a file
+    :param chunk_size: The number of characters to read at a time
+    :return: a generator of tokens
     """
-    tokens = list()
+    if input_data is None and path.exists(str(datalog_file)):
+        stream = open(datalog_file)
+    else:
+        stream = StringIO(input_data or "")
+
+    with stream:
+        buffer = ""
+        position = 0
+        line_number = 1
+        chunk = True
+        while chunk:
+            # Keep the unfinished token and read the next chunk behind it
+            chunk = stream.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            tokens = TokenBuffer(buffer)
+            position, line_number = _scan_into(tokens, 0, line_number, ignore_whitespace, ignore_comments,
+                                               final=not chunk)
+            yield from tokens
+    trace('eof', "Adding EOF Token at line {}", line_number)
+    yield Token(t_type=TokenType.EOF, value="", line_number=line_number)
 
+
+def scan_parallel(datalog_file: str = None, ignore_whitespace: bool = True, ignore_comments: bool = True,
+                  input_data: str = None, workers: int = None, chunk_size: int = PARALLEL_CHUNK_SIZE) -> TokenBuffer:
+    """
+    Produce the same tokens as scan, lexing pieces of the input in a pool of processes.
+    The input is split after newlines and every piece is lexed as if a token started there.  That is only wrong if the
+    newline was inside of a block comment or a string, so the pieces are stitched together in order: wherever the
+    previous piece stopped short of, or ran past, the start of the next one, the text in between is lexed again
+    until it reaches a token that was also found in one of the pieces.
+    :param ignore_comments:
+    :param ignore_whitespace:
+    :param datalog_file: The example datalog file being parsed
+    :param input_data: Scan this string instead of a file
+    :param workers: The number of processes to use, defaults to the number of CPUs
+    :param chunk_size: The approximate number of characters to lex in each process at a time
+    :return: a compact sequence of tokens
+    """
     file_string = ""
     if input_data is None and path.exists(str(datalog_file)):
         with open(datalog_file) as datalog_file_stream:
-            file_string = "".join([line for line in datalog_file_stream])
+            file_string = datalog_file_stream.read()
     elif input_data is not None:
         file_string = input_data
 
-    line_number = 1
-    while file_string:
-        token = Token(s_input=file_string, line_number=line_number)
-        file_string = file_string[len(token.value):]
-        if token.type == TokenType.INVALID:
-            logger.debug('Token was invalid %s' % token.value.replace('\n', '\\n'))
-            tokens.append(Token(t_type=TokenType.UNDEFINED, value=token.value[0], line_number=line_number))
-            # file_string = token.value[1:]
-        elif ignore_whitespace and token.type == TokenType.WHITESPACE:
-            logger.debug('Ignoring whitespace "%s"' % token.value.replace('\n', '\\n'))
-        elif ignore_comments and token.type == TokenType.COMMENT:
-            logger.debug('Ignoring Comment "%s"' % token.value.replace('\n', '\\n'))
+    workers = workers or multiprocessing.cpu_count()
+    if workers < 2 or len(file_string) < 2 * chunk_size:
+        return scan(input_data=file_string, ignore_whitespace=ignore_whitespace, ignore_comments=ignore_comments)
+
+    starts = [0]
+    while True:
+        newline = file_string.find('\n', starts[-1] + chunk_size)
+        if newline == -1 or newline + 1 == len(file_string):
+            break
+        starts.append(newline + 1)
+    ends = starts[1:] + [len(file_string)]
+    logger.info("Lexing {} pieces of the input in {} processes".format(len(starts), workers))
+    with multiprocessing.Pool(workers) as pool:
+        pieces = pool.starmap(_scan_piece, (
+            (file_string[start:end], end == len(file_string), ignore_whitespace, ignore_comments)
+            for start, end in zip(starts, ends)
+        ))
+
+    def piece_token(offset: int) -> bool:
+        # True if one of the pieces found a token at this offset of the input
+        i = bisect_right(starts, offset) - 1
+        piece = pieces[i][0]
+        index = bisect_left(piece.starts, offset - starts[i])
+        return index < len(piece) and piece.starts[index] == offset - starts[i]
+
+    tokens = TokenBuffer(file_string)
+    position, line_number = 0, 1
+    while position < len(file_string):
+        i = bisect_right(starts, position) - 1
+        if not piece_token(position):
+            trace('boundary', "Re-lexing the boundary of piece {} at offset {}", i, position)
+            position, line_number = _scan_into(tokens, position, line_number, ignore_whitespace, ignore_comments,
+                                               stop=piece_token)
+            continue
+        # The rest of this piece is lexed the same way it would have been by scan
+        piece, stopped = pieces[i]
+        index = bisect_left(piece.starts, position - starts[i])
+        tokens.extend(piece, index, offset=starts[i], lines=line_number - piece.line_numbers[index])
+        line_number += file_string.count('\n', position, starts[i] + stopped)
+        position = starts[i] + stopped
+    tokens.append(TokenType.EOF, len(file_string), len(file_string), line_number)
+    return tokens
+
+
+def _scan_piece(piece: str, final: bool, ignore_whitespace: bool, ignore_comments: bool) -> (TokenBuffer, int):
+    """
+    Lex part of the input in a worker process, counting lines from zero
+    :return: The tokens without their source, which the caller already has, and the offset where scanning stopped
+    """
+    tokens = TokenBuffer(piece)
+    stopped, _ = _scan_into(tokens, 0, 0, ignore_whitespace, ignore_comments, final=final)
+    tokens.source = ""
+    return tokens, stopped
+
+
+def rescan(tokens: TokenBuffer, input_data: str, start: int, removed: int, added: int, ignore_whitespace: bool = True,
+           ignore_comments: bool = True) -> TokenBuffer:
+    """
+    Scan text after an edit, only lexing the part of it that the edit could have changed.
+    Tokens that ended before the edit are kept as they were.  Scanning restarts at the end of the last of them and stops
+    at the first offset after the edit that also started a token before it, the rest of the text lexes the same way it
+    did before and those tokens are only moved by the number of characters and lines that the edit added.
+    :param tokens: The result of scanning the text before the edit with the same ignore_whitespace and ignore_comments
+    :param input_data: The text after the edit
+    :param start: The offset where the edit starts
+    :param removed: The number of characters the edit removed
+    :param added: The number of characters the edit inserted
+    :return: The same tokens that scan would produce for input_data
+    """
+    shift = added - removed
+    edit_end = start + added
+
+    # A token only ever looks at the character right after it, so any token that ended before the edit is unchanged
+    keep = bisect_left(tokens.ends, start)
+    if keep:
+        position = tokens.ends[keep - 1]
+        line_number = tokens.line_numbers[keep - 1] + tokens.source.count('\n', tokens.starts[keep - 1], position)
+    else:
+        position, line_number = 0, 1
+
+    def resynchronized(offset: int) -> bool:
+        if offset < edit_end:
+            return False
+        index = bisect_left(tokens.starts, offset - shift, keep)
+        return index < len(tokens) and tokens.starts[index] == offset - shift
+
+    result = TokenBuffer(input_data)
+    result.extend(tokens, 0, keep)
+    position, line_number = _scan_into(result, position, line_number, ignore_whitespace, ignore_comments,
+                                       stop=resynchronized)
+
+    # The end of the text always lines up with the EOF token from before the edit
+    index = bisect_left(tokens.starts, position - shift, keep)
+    trace('rescan', "Re-scanned {} characters, reusing {} tokens before and {} tokens after the edit",
+          position - tokens.ends[keep - 1] if keep else position, keep, len(tokens) - index)
+    result.extend(tokens, index, offset=shift, lines=line_number - tokens.line_numbers[index])
+    return result
+
+
+def _scan_into(tokens: TokenBuffer, position: int, line_number: int, ignore_whitespace: bool, ignore_comments: bool,
+               final: bool = True, stop: Callable[[int], bool] = None) -> (int, int):
+    """
+    Append the tokens found in the source of a TokenBuffer to it, starting at the given offset
+    :param tokens: The buffer to add tokens to
+    :param position: The offset in the source to start scanning from
+    :param line_number: The line number at that offset
+    :param final: If this isn't the end of the input, stop at a token that reaches the end of the source
+    :param stop: Stop before the token at any offset this returns True for
+    :return: The offset and line number that scanning stopped at
+    """
+    source = tokens.source
+    types = TokenType.__members__
+    # Check once whether to trace, rather than formatting messages for every token that nobody reads
+    traced = trace.enabled
+    # Walk the input with an offset instead of slicing off each token, slicing made lexing quadratic
+    while position < len(source):
+        if stop is not None and stop(position):
+            break
+        match = TOKEN_PATTERN.match(source, position)
+        end = match.end()
+        if not final and end == len(source):
+            break
+        t_type = types[match.lastgroup]
+        if t_type == TokenType.INVALID:
+            if traced:
+                trace('invalid', 'Token was invalid {}', match.group().replace('\n', '\\n'))
+            tokens.append(TokenType.UNDEFINED, position, position + 1, line_number)
+        elif ignore_whitespace and t_type == TokenType.WHITESPACE:
+            if traced:
+                trace('ignore', 'Ignoring whitespace "{}"', match.group().replace('\n', '\\n'))
+        elif ignore_comments and t_type == TokenType.COMMENT:
+            if traced:
+                trace('ignore', 'Ignoring Comment "{}"', match.group().replace('\n', '\\n'))
         else:
-            logger.debug('Adding Token %s' % str(token).replace('\n', '\\n'))
-            tokens.append(token)
+            tokens.append(t_type, position, end, line_number)
+            if traced:
+                trace('token', 'Adding Token {}', str(tokens[-1]).replace('\n', '\\n'))
 
         # Increment line number after adding tokens
-        token_lines = token.value.count('\n')
+        token_lines = source.count('\n', position, end)
         line_number += token_lines
-        logger.log(logging.DEBUG - 5, "Added {} Lines to Line counter.  Current line is: {}".format(token_lines, line_number))
-    tokens.append(Token(t_type=TokenType.EOF, value="", line_number=line_number))
-    logger.debug("Adding EOF Token at line {}".format(line_number))
-    return tokens
+        if traced:
+            trace('line', "Added {} Lines to Line counter.  Current line is: {}", token_lines, line_number, level=TRACE)
+        position = end
+    return position, line_number
 
 
 if __name__ == "__main__":
@@ -58,16 +256,25 @@ if __name__ == "__main__":
 
     args = ArgumentParser(description="Run the lexical analyzer, this will produce output for lab 1")
     args.add_argument('-d', '--debug', help="The logging debug level to use", default=logging.NOTSET, metavar='LEVEL')
+    args.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                      help="Lex large files in this many processes at once")
     args.add_argument('file', help='datalog file to lexically analyze')
     arg = args.parse_args()
 
     # Set all other loggers to ERROR only and then set this file's logging level
     logging.basicConfig(level=logging.ERROR)
     logger.setLevel(int(arg.debug))
+    tracing.configure()
     d_file = arg.file
 
-    all_tokens = scan(d_file, ignore_whitespace=True, ignore_comments=False)
+    if arg.jobs > 1:
+        all_tokens = scan_parallel(d_file, ignore_whitespace=True, ignore_comments=False, workers=arg.jobs)
+    else:
+        all_tokens = scan_iter(d_file, ignore_whitespace=True, ignore_comments=False)
+
+    total_tokens = 0
     for single_token in all_tokens:
         print(single_token)
+        total_tokens += 1
 
-    print("Total Tokens = %s" % len(all_tokens))
+    print("Total Tokens = %s" % total_tokens)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tracing
+
+from os import path
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+
+import datalog_parser
+import lexical_analyzer
+
+from tokens import TokenBuffer, TokenError
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+trace = Trace(logger, 'cache')
+
+# Parsed programs are only cached if DATALOG_CACHE is set to the directory to keep them in
+CACHE_DIR = os.environ.get('DATALOG_CACHE', '')
+# The directory that this module's main parses programs into if DATALOG_CACHE isn't set
+DEFAULT_CACHE_DIR = path.join(path.expanduser('~'), '.cache', 'datalog')
+# Once the cache is bigger than this many bytes, the least recently used programs are removed
+CACHE_SIZE = 256 << 20
+
+# The code that a cached program depends on, if any of it changes then so does the key of every program
+_SOURCES = (datalog_parser.__file__, lexical_analyzer.__file__, sys.modules[TokenBuffer.__module__].__file__, __file__)
+_version = None
+
+
+def parser_version() -> str:
+    """
+    :return: A hash of the lexer, the parser and the format that programs are cached in
+    """
+    global _version
+    if _version is None:
+        version = hashlib.sha256("{} {}".format(sys.version, np.__version__).encode())
+        for source in _SOURCES:
+            with open(source, 'rb') as source_file:
+                version.update(source_file.read())
+        _version = version.hexdigest()
+    return _version
+
+
+def parse(datalog_file: str = None, input_data: str = None, cache_dir: str = None,
+          cache_size: int = CACHE_SIZE) -> datalog_parser.DatalogProgram:
+    """
+    Parse a datalog file, reusing the program parsed from the same text by the same parser if there is one.
+    Failures are cached too, and raise the same TokenError every time.
+    :param datalog_file: The datalog file to parse
+    :param input_data: Parse this string instead of a file
+    :param cache_dir: The directory to cache programs in, defaults to CACHE_DIR.  An empty directory turns caching off
+    :param cache_size: The number of bytes the cache can use
+    :return: The parsed program
+    """
+    file_string = ""
+    if input_data is None and path.exists(str(datalog_file)):
+        with open(datalog_file) as datalog_file_stream:
+            file_string = datalog_file_stream.read()
+    elif input_data is not None:
+        file_string = input_data
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+
+    key = hashlib.sha256(parser_version().encode() + file_string.encode('utf-8', 'surrogatepass')).hexdigest()
+    cache_file = path.join(cache_dir, key + '.pickle') if cache_dir else None
+    program = _load(cache_file) if cache_file else None
+    if program is None:
+        trace('miss', "Parsing '{}'", datalog_file or key)
+        try:
+            program = datalog_parser.DatalogProgram(lexical_analyzer.scan(input_data=file_string))
+        except TokenError as t:
+            program = t
+        if cache_file:
+            _store(cache_file, program, cache_size)
+    else:
+        trace('hit', "Loaded '{}' from {}", datalog_file or key, cache_file)
+
+    if isinstance(program, TokenError):
+        raise program
+    return program
+
+
+def _load(cache_file: str) -> datalog_parser.DatalogProgram or TokenError or None:
+    try:
+        with open(cache_file, 'rb') as cache_stream:
+            program = pickle.load(cache_stream)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A file that was cut short, is stale or is corrupt can fail to unpickle in any number of ways
+        logger.warning("Removing unreadable cache file {}: {}".format(cache_file, e))
+        _remove(cache_file)
+        return None
+    try:
+        # The modification time of a file is when it was last used
+        os.utime(cache_file)
+    except OSError:
+        pass
+    return program
+
+
+def _store(cache_file: str, program: datalog_parser.DatalogProgram or TokenError, cache_size: int):
+    """
+    Write the program to a temporary file first and then move it into place, so that a file in the cache is always
+    complete even if other processes are reading or writing the same one
+    """
+    cache_dir = path.dirname(cache_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as temp:
+            pickle.dump(program, temp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp.name, cache_file)
+    except (OSError, pickle.PicklingError, RecursionError) as e:
+        logger.warning("Unable to cache {}: {}".format(cache_file, e))
+        return
+    evict(cache_dir, cache_size)
+
+
+def evict(cache_dir: str = None, cache_size: int = CACHE_SIZE):
+    """
+    Remove the least recently used programs until the cache fits in cache_size bytes
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    entries = []
+    with os.scandir(cache_dir) as cache_entries:
+        for entry in cache_entries:
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, cache_file in sorted(entries):
+        if total <= cache_size:
+            break
+        trace('evict', "Evicting {}", cache_file)
+        _remove(cache_file)
+        total -= size
+
+
+def _remove(cache_file: str):
+    try:
+        os.remove(cache_file)
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == "__main__":
+    """
+    Parse files into the cache ahead of time
+    """
+    from argparse import ArgumentParser
+
+    arg = ArgumentParser(description="Parse datalog files into the cache, so that the other labs load them quickly "
+                                     "when DATALOG_CACHE is set to the same directory")
+    arg.add_argument('-d', '--debug', help="The logging debug level to use", default=logging.NOTSET, metavar='LEVEL')
+    arg.add_argument('-c', '--cache', help="The cache directory", default=CACHE_DIR or DEFAULT_CACHE_DIR)
+    arg.add_argument('files', nargs='+', help='datalog files to parse')
+    args = arg.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    logger.setLevel(int(args.debug))
+    tracing.configure()
+
+    for d_file in args.files:
+        try:
+            parse(d_file, cache_dir=args.cache)
+            print("{}: Success!".format(d_file))
+        except TokenError as t:
+            print("{}: Failure!\n  {}".format(d_file, t))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from os import path
+from tempfile import mkdtemp
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+import datalog_parser
+
+from column_store import ColumnRelation, MISSING, symbol_columns
+from tokens import SYMBOLS
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+trace = Trace(logger, 'store')
+
+# The layout of a snapshot, snapshots in any other layout are not loaded
+FORMAT = 1
+# The files in a snapshot besides the columns
+INDEX_FILE = 'snapshot.json'
+SYMBOLS_FILE = 'symbols.json'
+
+
+class SnapshotError(Exception):
+    """A snapshot could not be saved or loaded"""
+
+
+class Snapshot(NamedTuple):
+    """
+    Relations saved by an RDBMS, by the symbol of their name.
+    facts are the relations populated from the facts of the program, and derived are the relations that its rules
+    changed, after passes passes through the rules of the program with the key program
+    """
+    facts: Dict[int, ColumnRelation]
+    derived: Dict[int, ColumnRelation]
+    passes: Optional[int]
+    program: Optional[str]
+
+    def __str__(self) -> str:
+        rows = sum(map(len, self.facts.values())) + sum(map(len, self.derived.values()))
+        return "{} relations of facts and {} derived relations, {} rows".format(len(self.facts), len(self.derived),
+                                                                                 rows)
+
+
+def program_key(datalog_program: datalog_parser.DatalogProgram) -> str:
+    """
+    :return: A hash of the schemes and rules of a program, which decide what relations are derived from the facts
+    """
+    return hashlib.sha256("{}\n{}".format(
+        datalog_program.schemes, datalog_program.rules
+    ).encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def save(directory: str, facts: Dict[int, object], derived: Dict[int, object] = None, passes: int = None,
+         program: str = None):
+    """
+    Save relations as a .npy file for each column, with the values of the symbols that they hold.
+    The snapshot is written to a temporary directory first and then moved into place, so a snapshot is always complete
+    and any snapshot already in the directory is replaced
+    :param directory: The directory of the snapshot
+    :param facts: The relations of the facts of a program, either ColumnRelations or pandas relations
+    :param derived: The relations that the rules of the program changed
+    :param passes: The number of passes through the rules that derived them
+    :param program: The program_key of the program
+    """
+    directory = path.abspath(directory)
+    if path.exists(directory) and os.listdir(directory) and not path.exists(path.join(directory, INDEX_FILE)):
+        raise SnapshotError("Not replacing {}, it isn't a snapshot".format(directory))
+    os.makedirs(path.dirname(directory), exist_ok=True)
+    temp = mkdtemp(dir=path.dirname(directory), prefix=path.basename(directory) + '.', suffix='.tmp')
+    try:
+        index = {
+            'format': FORMAT,
+            'passes': passes,
+            'program': program,
+            'facts': _save_relations(temp, 'facts', facts),
+            'derived': _save_relations(temp, 'derived', derived or {}),
+        }
+        with open(path.join(temp, SYMBOLS_FILE), 'w') as symbols_stream:
+            json.dump(SYMBOLS.values[:], symbols_stream)
+        with open(path.join(temp, INDEX_FILE), 'w') as index_stream:
+            json.dump(index, index_stream, indent=1)
+        if path.exists(directory):
+            # A directory can only be renamed over an empty one, processes that mapped the old columns keep them
+            old = mkdtemp(dir=path.dirname(directory), prefix=path.basename(directory) + '.', suffix='.old')
+            os.replace(directory, old)
+            os.replace(temp, directory)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.replace(temp, directory)
+    except BaseException:
+        shutil.rmtree(temp, ignore_errors=True)
+        raise
+    trace('save', "Saved {} relations of facts and {} derived relations to {}",
+          len(index['facts']), len(index['derived']), directory)
+
+
+def _save_relations(directory: str, kind: str, relations: Dict[int, object]) -> List[dict]:
+    """
+    :param kind: What the relations are, which starts the names of their files
+    :return: The entries of the relations in the index
+    """
+    entries = []
+    for i, (symbol, relation) in enumerate(relations.items()):
+        files = []
+        for j, column in enumerate(symbol_columns(relation)):
+            files.append("{}.{}.{}.npy".format(kind, i, j))
+            np.save(path.join(directory, files[-1]), column)
+        entries.append({'name': SYMBOLS[symbol], 'rows': len(relation), 'files': files})
+    return entries
+
+
+def load(directory: str) -> Snapshot:
+    """
+    Load a snapshot with its columns mapped into memory read only, so they are only read as they are used and their
+    pages are shared by every process that loads the snapshot.
+    The values of the symbols in the snapshot are interned first.  If this process hasn't interned any other values,
+    which is the case if the snapshot is loaded before any programs are parsed, then the symbols are the same and the
+    columns are used as they are.  Otherwise the columns are copied with the symbols of this process.
+    :raises SnapshotError: If the directory doesn't have a snapshot that can be read
+    """
+    try:
+        with open(path.join(directory, INDEX_FILE)) as index_stream:
+            index = json.load(index_stream)
+        with open(path.join(directory, SYMBOLS_FILE)) as symbols_stream:
+            values = json.load(symbols_stream)
+    except (OSError, ValueError) as e:
+        raise SnapshotError("Unable to read the snapshot {}: {}".format(directory, e))
+    if not isinstance(index, dict) or index.get('format') != FORMAT:
+        raise SnapshotError("{} is not a snapshot in format {}".format(directory, FORMAT))
+
+    symbols = _intern(values)
+    try:
+        snapshot = Snapshot(
+            facts=_load_relations(directory, index['facts'], symbols),
+            derived=_load_relations(directory, index['derived'], symbols),
+            passes=index['passes'],
+            program=index['program'],
+        )
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise SnapshotError("Unable to read the snapshot {}: {}".format(directory, e))
+    trace('load', "Loaded {} from {}{}", snapshot, directory, "" if symbols is None else " with new symbols")
+    return snapshot
+
+
+def _intern(values: List[str]) -> Optional[np.ndarray]:
+    """
+    Intern the values of the symbols of a snapshot
+    :return: The symbol in this process of each symbol in the snapshot, or None if they are the same
+    """
+    known = min(len(SYMBOLS), len(values))
+    if SYMBOLS.values[:known] == values[:known]:
+        # The values are all different, so the ones this process doesn't have are interned in order after the others
+        SYMBOLS.intern_all(values[known:])
+        return None
+    return SYMBOLS.intern_all(values)
+
+
+def _load_relations(directory: str, entries: List[dict], symbols: Optional[np.ndarray]) -> Dict[int, ColumnRelation]:
+    """
+    :param symbols: The symbol of each symbol in the files, if they aren't the same
+    """
+    relations = dict()
+    for entry in entries:
+        columns = []
+        for file in entry['files']:
+            column = np.load(path.join(directory, file), mmap_mode='r', allow_pickle=False)
+            if column.dtype != np.int64 or column.ndim != 1 or len(column) != entry['rows']:
+                raise ValueError("{} is not a column of {} symbols".format(file, entry['rows']))
+            if symbols is not None:
+                column = np.where(column == MISSING, MISSING, symbols[column])
+            columns.append(column)
+        relations[SYMBOLS.intern(entry['name'])] = ColumnRelation(columns)
+    return relations
@@ -1,208 +1,662 @@
 #!/usr/bin/env python3
-import csv
+
 import multiprocessing
+import multiprocessing.pool
 
 from collections import OrderedDict
+from io import StringIO
+from itertools import chain
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, TextIO, Tuple, Union
 from pandas import DataFrame as Relation, np
-from tokens import TokenType, TokenError, Token
+from column_store import ColumnRelation, MISSING, symbol_columns
+from tokens import SYMBOLS, TokenType, TokenError, to_number
 
+import catalog
 import datalog_parser
+import fact_import
 import logging
-import lexical_analyzer
+import parse_cache
+import relation_store
+import tracing
+
+from tracing import Trace
 
 logger = logging.getLogger(__name__)
+trace = Trace(logger, 'rdbms')
 
 SINGLE_MATCH = 1
 
+# The ways that relations can be stored, 'numpy' keeps columns of symbols in a ColumnRelation
+ENGINES = ('numpy', 'pandas')
+ENGINE = 'numpy'
+# The number of rows that are decoded and formatted at a time when writing results
+CHUNK_SIZE = 1 << 13
+# The number of bytes of query results that are kept to answer the same query again, 0 turns the cache off
+QUERY_CACHE_SIZE = 64 << 20
+# Answers with fewer rows than this in total are formatted in this process, it isn't worth waiting on a pool for them
+PARALLEL_ROWS = 4 * CHUNK_SIZE
+# The number of chunks that are sent to a process of the format pool at a time
+FORMAT_BATCH = 4
+
+
+class QueryCache:
+    """
+    The results of queries by the text of the query, each with the version of the relation that it was answered from.
+    A result is only reused while its relation is still at that version.
+    Once the results take more than size bytes the least recently used are evicted.
+    used counts every array of every result, but a result that only projected or selected columns can share them with
+    the relation that it was answered from, so used is an upper bound on the memory that the cache holds on to
+    """
+    def __init__(self, size: int = QUERY_CACHE_SIZE):
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.results = OrderedDict()  # type: OrderedDict[str, Tuple[int, Relation or int, int]]
+
+    def get(self, key: str, version: int) -> Relation or int or None:
+        """
+        :return: The result for the key at the version, or None if there isn't one
+        """
+        entry = self.results.get(key)
+        if entry is not None and entry[0] == version:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, version: int, result: Relation or int):
+        """
+        Keep a result, replacing the result for any other version of the relation
+        """
+        if key in self.results:
+            self.used -= self.results.pop(key)[2]
+        size = self.nbytes(result)
+        if not self.size or size > self.size:
+            return
+        self.results[key] = (version, result, size)
+        self.used += size
+        while self.used > self.size:
+            evicted, (_, _, evicted_size) = self.results.popitem(last=False)
+            trace('evict', "Evicting the result of {}?", evicted)
+            self.used -= evicted_size
+            self.evictions += 1
+
+    @staticmethod
+    def nbytes(result: Relation or int) -> int:
+        if isinstance(result, ColumnRelation):
+            return sum(column.nbytes for column in result.columns)
+        elif isinstance(result, Relation):
+            return int(result.memory_usage(index=True).sum())
+        return 0
+
+    def __str__(self) -> str:
+        return "{} hits, {} misses, {} evictions, {} results in {} bytes".format(
+            self.hits, self.misses, self.evictions, len(self.results), self.used)
+
+
+# The numpy operation of each operator in an expression
+OPERATORS = {TokenType.ADD: np.add, TokenType.MULTIPLY: np.multiply}
+# A compiled expression, which computes its value for every row at once from a function that gives the numbers in a
+# column of the relation
+Computation = Callable[[Callable[[int], np.ndarray]], Union[np.ndarray, float]]
+
+
+def compile_expression(expression: datalog_parser.Expression, columns: Dict[int, int]) -> Optional[Computation]:
+    """
+    Compile an expression into numpy operations on whole columns, so nested expressions are only worked out once.
+    Strings are the numbers that they hold, and anything that isn't a number is NaN
+    :param columns: The column of each variable that the expression can use, by the symbol of the variable
+    :return: The computation, or None if the expression has no operator or a variable that isn't in columns
+    """
+    if expression.operator is None or expression.operator.type not in OPERATORS:
+        return None
+    operation = OPERATORS[expression.operator.type]
+    operands = []
+    for parameter in (expression.param_1, expression.param_2):
+        if parameter.expression:
+            operand = compile_expression(parameter.expression, columns)
+        elif parameter.string_id.type is TokenType.STRING:
+            operand = (lambda number: lambda values: number)(to_number(parameter.string_id.value))
+        elif parameter.string_id.symbol in columns:
+            operand = (lambda column: lambda values: values(column))(columns[parameter.string_id.symbol])
+        else:
+            operand = None
+        if operand is None:
+            return None
+        operands.append(operand)
+    first, second = operands
+    return lambda values: operation(first(values), second(values))
+
+
+class QueryPlan(NamedTuple):
+    """
+    What evaluating a query needs to know about its parameters, worked out once when the query is compiled
+    """
+    # The text of the query, which its results are cached by
+    key: str
+    # The symbol of the name of the relation
+    relation: int
+    # The column and symbol of each constant, in order
+    constants: Tuple[Tuple[int, int], ...]
+    # The columns of the variables, in order
+    columns: Tuple[int, ...]
+    # The symbols of the variables of those columns, which the columns are renamed to
+    names: Tuple[int, ...]
+    # If a variable is repeated then every variable once, in the order that they first appear
+    groups: Tuple[int, ...]
+    # The column of each expression and its computation, rows are kept where the column's number is the same
+    expressions: Tuple[Tuple[int, Computation], ...] = ()
+
+    @classmethod
+    def compile(cls, query: datalog_parser.Query) -> 'QueryPlan':
+        constants, columns, names, expressions = [], [], [], []
+        for i, x in enumerate(query.parameterList):
+            if x.expression:
+                expressions.append((i, x.expression))
+            elif x.string_id.type is TokenType.STRING:
+                constants.append((i, x.string_id.symbol))
+            elif x.string_id.type is TokenType.ID:
+                columns.append(i)
+                names.append(x.string_id.symbol)
+        groups = list(OrderedDict.fromkeys(names)) if len(set(names)) < len(names) else ()
+        # Expressions use the first column of each of the variables of the query
+        variables = dict(zip(reversed(names), reversed(columns)))
+        computations = []
+        for i, expression in expressions:
+            computation = compile_expression(expression, variables)
+            if computation is None:
+                logger.warning("Ignoring parameter {} of {}, its expression has no operator or a variable that isn't "
+                               "a parameter of {}".format(i + 1, query.id.value, query.id.value))
+            else:
+                computations.append((i, computation))
+        return cls(str(query), query.id.symbol, tuple(constants), tuple(columns), tuple(names), tuple(groups),
+                   tuple(computations))
+
+    def __str__(self) -> str:
+        return "QueryPlan(constants={}, columns={}, names={}, groups={}, expressions={})".format(
+            [(i, SYMBOLS[s]) for i, s in self.constants], list(self.columns), [SYMBOLS[s] for s in self.names],
+            [SYMBOLS[s] for s in self.groups], [i for i, _ in self.expressions])
+
+
+# A piece of the answers to write: the text before the rows, then the names of the columns and the sorted symbols of
+# the rows, which are None for answers without rows
+FormatTask = Tuple[str, Optional[List[str]], Optional[np.ndarray]]
+
+
+def format_rows(names: List[str], symbols: np.ndarray) -> np.ndarray:
+    """
+    Each line is built a column at a time by adding whole columns of strings, and values are written exactly as they
+    are whatever characters they contain
+    :param names: The name and '=' that starts each column of a line
+    :param symbols: The rows to format, in the order they are written
+    :return: The lines of the rows, without their indentation
+    """
+    decoded = SYMBOLS.decode(symbols)
+    lines = names[0] + decoded[:, 0]
+    for name, column in zip(names[1:], decoded.T[1:]):
+        lines = lines + (", " + name) + column
+    return lines
+
+
+def format_chunk(task: FormatTask) -> str:
+    """
+    This runs in the processes of the format pool, so it only depends on its task and the symbols
+    :return: The text of a piece of the answers as it is written
+    """
+    header, names, symbols = task
+    if symbols is None:
+        return header
+    return header + "  " + "\n  ".join(format_rows(names, symbols)) + "\n"
+
+
+_pool = None  # type: multiprocessing.pool.Pool
+_pool_workers = 0
+_pool_symbols = 0
+
+
+def format_pool(workers: int) -> multiprocessing.pool.Pool:
+    """
+    The pool is kept to format the answers of the next program too.
+    Its processes are forked with a copy of the symbols, so it is started again once there are symbols that they don't
+    have
+    :return: A pool of processes that format answers
+    """
+    global _pool, _pool_workers, _pool_symbols
+    if _pool is None or _pool_workers != workers or _pool_symbols != len(SYMBOLS):
+        if _pool is not None:
+            _pool.terminate()
+        # Decode once before forking so that the processes share the array of values instead of each building it
+        SYMBOLS.decode(np.empty(0, dtype=np.int64))
+        trace('pool', "Starting {} processes to format answers with {} symbols", workers, len(SYMBOLS))
+        _pool = multiprocessing.get_context('fork').Pool(workers)
+        _pool_workers, _pool_symbols = workers, len(SYMBOLS)
+    return _pool
+
 
 class RDBMS:
-    def __init__(self, datalog_program: datalog_parser.DatalogProgram):
+    def __init__(self, datalog_program: datalog_parser.DatalogProgram, engine: str = ENGINE,
+                 query_cache_size: int = QUERY_CACHE_SIZE, snapshot: relation_store.Snapshot = None,
+                 fact_files: Sequence[Tuple[str, str]] = ()):
+        """
+        :param engine: One of ENGINES, both give the same results
+        :param query_cache_size: The number of bytes of query results to keep
+        :param snapshot: Relations to use instead of the facts of the program for the schemes that it has
+        :param fact_files: Pairs of the name of a scheme and a CSV or TSV file of more facts to import into it
+        """
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine '{}', expected one of {}".format(engine, ", ".join(ENGINES)))
+        self.engine = engine
+        self.relation_type = ColumnRelation if engine == 'numpy' else Relation
         self.rdbms = OrderedDict()
         self.relations = dict()
+        # Each time a relation is replaced by one with different rows its version goes up
+        self.versions = dict()
+        self.query_cache = QueryCache(query_cache_size)
+        # The compiled plan of each query and predicate, a query that is asked twice is compiled twice
+        self.plans = dict()
+        # The relations that were populated from the facts of the program rather than from the snapshot
+        self.program_facts = set()
+        self.schemes = {scheme.id.value: scheme for scheme in datalog_program.schemes.schemes}
+        # The statistics of the relations, which count the rows that were added when they are next read
+        self.catalog = catalog.Catalog()
 
         # initialize the rdbms with query values
         for query in datalog_program.queries.queries:
-            self.rdbms[query] = Relation()
+            self.rdbms[query] = self.relation_type()
 
-        # Populate the relations
+        # Populate the relations straight from the columns of symbols of the facts with the same name as each scheme
         for scheme in datalog_program.schemes.schemes:
-            facts = [fact for fact in datalog_program.facts.facts if fact.id == scheme.id]
-            logger.debug("Scheme: {}".format(scheme))
-            logger.debug("Facts: {}".format(" ".join(str(f) for f in facts)))
-            if facts:
-                self.relations[scheme.id] = (Relation(
-                    data=[fact.stringList for fact in facts])
-                ).drop_duplicates()
+            columns = datalog_program.facts.columns.get(scheme.id.value)
+            trace('scheme', "Scheme: {}", scheme)
+            trace('facts', lambda: "Facts: {}".format(" ".join(
+                "{}({}).".format(scheme.id.value, ",".join(SYMBOLS[s] for s in row if s >= 0))
+                for row in zip(*columns)
+            )) if columns else "Facts: ")
+            if snapshot is not None and scheme.id.symbol in snapshot.facts:
+                # Duplicates were removed before the relation was saved
+                self.relations[scheme.id.symbol] = self.from_columns(snapshot.facts[scheme.id.symbol].columns)
+                continue
+            if columns and self.relation_type is ColumnRelation:
+                self.relations[scheme.id.symbol] = ColumnRelation(columns).unique()
+            elif columns:
+                self.relations[scheme.id.symbol] = self.from_columns(columns).drop_duplicates()
+            if columns:
+                self.program_facts.add(scheme.id.symbol)
+        for symbol, relation in self.relations.items():
+            self.catalog.count(symbol, relation)
+        for name, fact_file in fact_files:
+            self.import_facts(name, fact_file)
+        # The relations as they were populated, before any rules add to them
+        self.facts = dict(self.relations)
         for query in datalog_program.queries.queries:
             self.rdbms[query] = self.evaluate_query(query)
 
+    def from_columns(self, columns: Sequence[np.ndarray]) -> Relation:
+        """
+        :return: A relation of the engine's type with columns of symbols, where negative symbols are missing values
+        """
+        if self.relation_type is ColumnRelation:
+            return ColumnRelation(columns)
+        if not len(columns):
+            return Relation()
+        data = np.column_stack(columns)
+        missing = data < 0
+        if missing.any():
+            # Facts with fewer strings than others have no value in the last columns
+            data = data.astype(object)
+            data[missing] = None
+        return Relation(data=data)
+
+    def import_facts(self, name: str, fact_file: str, delimiter: str = None, header: bool = False):
+        """
+        Add the rows of a CSV or TSV file to the relation of a scheme as facts, without parsing them as datalog.
+        The values are interned as the same strings that facts with those values have, and only a chunk of rows is
+        read at a time so only the symbols of the file are kept in memory
+        :param name: The name of the scheme
+        :param delimiter: The character between values, which is guessed from the extension of the file by default
+        :param header: If the first row of the file names the columns rather than being a fact
+        :raises ValueError: If there is no scheme with the name or a row doesn't have a value for each of its attributes
+        """
+        scheme = self.schemes.get(name)
+        if scheme is None:
+            raise ValueError("{}: there is no scheme named '{}'".format(fact_file, name))
+        columns = fact_import.read_columns(fact_file, len(scheme.idList), delimiter=delimiter, header=header)
+        logger.info("Imported {} facts into {} from {}".format(len(columns[0]), name, fact_file))
+        if not len(columns[0]):
+            return
+
+        symbol = scheme.id.symbol
+        existing = self.relations.get(symbol)
+        if self.relation_type is ColumnRelation:
+            relation = ColumnRelation(columns).unique() if existing is None else existing.union(ColumnRelation(columns))
+        else:
+            relation = self.from_columns(columns)
+            relation = (relation if existing is None else existing.append(relation)).drop_duplicates()
+        self.relations[symbol] = relation
+        self.versions[symbol] = self.versions.get(symbol, 0) + 1
+        self.program_facts.add(symbol)
+        # The rows that were there already are still first
+        self.catalog.extend(symbol, relation, 0 if existing is None else len(existing))
+
+    def save(self, directory: str, derived: bool = True):
+        """
+        Save a snapshot of the relations of the facts, which a program with the same schemes can be loaded with
+        instead of parsing the facts again
+        :param derived: Also save the relations that rules derived, for databases that evaluate rules
+        """
+        relation_store.save(directory, self.facts)
+
+    def plan(self, query: datalog_parser.Query) -> QueryPlan:
+        """
+        :return: The plan of a query, which is only compiled the first time the query is evaluated
+        """
+        plan = self.plans.get(query)
+        if plan is None:
+            plan = self.plans[query] = QueryPlan.compile(query)
+            trace('plan', "Compiled {}? into {}", query, plan)
+        return plan
+
     def evaluate_query(self, query: datalog_parser.Query) -> Relation or int:
-        logger.debug("Evaluating query: {}?".format(query))
-        if self.relations.get(query.id, None) is None:
+        """
+        Answer a query, from the query cache if its relation hasn't changed since the last time it was asked.
+        Results are shared, so they must not be changed in place
+        """
+        plan = self.plan(query)
+        version = self.versions.get(plan.relation, 0)
+        result = self.query_cache.get(plan.key, version)
+        if result is None:
+            result = self.execute(plan)
+            self.query_cache.put(plan.key, version, result)
+        else:
+            trace('cached', "Answered {}? from the cache", plan.key)
+        return result
+
+    def execute(self, plan: QueryPlan) -> Relation or int:
+        trace('query', "Evaluating query: {}?", plan.key)
+        if self.relations.get(plan.relation, None) is None:
             # Create the Query if it doesn't exist
-            self.relations[query.id] = Relation()
+            self.relations[plan.relation] = self.relation_type()
 
-        relation = self.relations[query.id]
-        logger.debug("Relation:\n{}".format(self.print_relation(relation)))
+        relation = self.relations[plan.relation]
+        trace('relation', lambda: "Relation:\n{}".format(self.print_relation(relation, named=False)))
         if relation.empty:
-            logger.debug("Relation empty")
+            trace('empty', "Relation empty")
             return relation
 
-        selected = self.select(relation, query)
+        selected = self.select(relation, plan)
         if selected.empty:
-            logger.debug("No matches found")
+            trace('no_match', "No matches found")
             return selected
-        relation = self.project(selected, query)
+        relation = self.project(selected, plan)
         # If projecting is going to remove the only match
         if relation.empty and not selected.empty:
-            logger.debug("Found single match")
+            trace('single_match', "Found single match")
             return SINGLE_MATCH  # return len(selected)
 
-        relation = self.rename(relation, query)
-        relation = self.inner_join(relation)
-        relation = self.project(relation)
+        relation = self.rename(relation, plan)
+        if plan.groups:
+            relation = self.inner_join(relation, plan)
         return relation.dropna()
 
-    def select(self, relation: Relation, query: datalog_parser.Query) -> Relation:
+    def select(self, relation: Relation, plan: QueryPlan) -> Relation:
         # If a parameter is a string, then select the rows that match that string in the right columns
-        for i, x in enumerate(query.parameterList):
-            if (not x.expression) and (x.string_id.type is TokenType.STRING):
-                mask = relation[[i]].as_matrix() == ([x.string_id])
+        if isinstance(relation, ColumnRelation):
+            # The rows are looked up in the indexes of the relation
+            relation = relation.select(plan.constants)
+        else:
+            for i, symbol in plan.constants:
+                mask = relation[[i]].values == ([symbol])
                 relation = relation[mask]
-        logger.debug("Selected:\n{}".format(self.print_relation(relation)))
+        if plan.expressions:
+            relation = self.compute(relation, plan)
+        trace('select', lambda: "Selected:\n{}".format(self.print_relation(relation, named=False)))
         return relation
 
-    def project(self, relation: Relation, query: datalog_parser.Query = None) -> Relation:
+    def compute(self, relation: Relation, plan: QueryPlan) -> Relation:
+        """
+        Keep the rows where the number in the column of each expression is the number that the expression computes
+        from the rest of the row.  Values that aren't numbers are never equal to anything
+        """
+        numbers = SYMBOLS.numbers()
+        columns = symbol_columns(relation)
+        computed = dict()
+
+        def values(column: int) -> np.ndarray:
+            # The numbers in a column are only looked up once however many expressions use it
+            if column not in computed:
+                computed[column] = numbers[columns[column]] if column < len(columns) else np.full(len(relation), np.nan)
+            return computed[column]
+
+        keep = np.logical_and.reduce([values(i) == computation(values) for i, computation in plan.expressions])
+        trace('compute', "Kept {} of {} rows with {} expressions",
+              int(keep.sum()), len(relation), len(plan.expressions))
+        return relation.take(keep) if isinstance(relation, ColumnRelation) else relation[keep]
+
+    def project(self, relation: Relation, plan: QueryPlan) -> Relation:
         """
         Project the columns that have the IDs in the query.
-        If no query, then remove duplicate columns
         :param relation:
-        :param query:
+        :param plan:
         """
-        if query is None:
-            _, indices = np.unique(relation.columns, return_index=True)
-            relation = relation.iloc[:, np.sort(indices)]
-            logger.debug("Projected:\n{}".format(self.print_relation(relation)))
+        if isinstance(relation, ColumnRelation):
+            relation = relation.project(plan.columns)
         else:
-            columns = [query.parameterList.index(x) for x in query.parameterList
-                       if (not x.expression) and (x.string_id.type is TokenType.ID)]
+            columns = list(plan.columns)
             relation = relation.reindex(columns=columns)[columns]
-            logger.debug("Projected:\n{}".format(self.print_relation(relation)))
+        trace('project', lambda: "Projected:\n{}".format(self.print_relation(relation, named=False)))
         return relation
 
-    def rename(self, relation: Relation, query: datalog_parser.Query) -> Relation:
-        column_names = [
-            x.string_id for x in query.parameterList if (not x.expression) and (x.string_id.type is TokenType.ID)
-        ]
-        relation.columns = column_names
-        logger.debug("Renamed:\n{}".format(relation))
+    def rename(self, relation: Relation, plan: QueryPlan) -> Relation:
+        # The columns are named by the symbols of the variables
+        if isinstance(relation, ColumnRelation):
+            relation = relation.rename(plan.names)
+            trace('rename', lambda: "Renamed:\n{}".format(self.decode(relation)))
+            return relation.unique()
+        relation.columns = plan.names
+        trace('rename', lambda: "Renamed:\n{}".format(self.decode(relation)))
         return relation.drop_duplicates()
 
-    @staticmethod
-    def _inner_join(relation: Relation) -> Relation:
-        name = list(relation)[0]
-        result = {name: []}
-        for index, row in relation.iterrows():
-            single = row.drop_duplicates()
-            if len(single) == 1:
-                result[name].append(list(single)[0])
-            else:
-                result[name].append(None)
-        return Relation(result)
-
-    def inner_join(self, relation: Relation) -> Relation:
+    def inner_join(self, relation: Relation, plan: QueryPlan) -> Relation:
         """
-        Remove rows where multiple columns have the same name but not the same value
+        Remove rows where multiple columns have the same name but not the same value, and keep one column of each name.
+        Each name is a mask of the rows where all of its columns are equal, computed over whole columns at once
         :param relation:
+        :param plan: The plan of the query, with each name once in the order that the names first appear
         :return:
         """
-        column_names = list(relation)
-        if len(column_names) == len(set(column_names)):
-            logger.debug("No inner join needs to be done")
-            return relation
-        relation = relation. \
-            groupby(lambda x: x, axis=1). \
-            apply(self._inner_join). \
-            dropna(how='all', axis=1). \
-            dropna(how='any'). \
-            reset_index(drop=True)
-        if not relation.empty:
-            relation.columns = column_names[:len(relation.columns)]
-        logger.debug("Inner Joined:\n{}".format(relation))
+        frame = not isinstance(relation, ColumnRelation)
+        if frame:
+            relation = ColumnRelation(relation.fillna(MISSING).values.astype(np.int64).T, plan.names)
+
+        relation = relation.collapse(plan.groups)
+
+        if frame:
+            relation = relation.dropna()
+            relation = Relation(relation.values, columns=list(relation))
+        trace('inner_join', lambda: "Inner Joined:\n{}".format(self.decode(relation)))
         return relation
 
     @staticmethod
-    def print_relation(relation: Relation) -> (int, str):
-        # TODO this is where most time is spent in the program, optimize it for the speed boosts
-        if not relation.empty:
-            relation = relation.sort_values(list(relation))
-            relation = relation.apply(
-                lambda column: column.apply(
-                    lambda c: str(column.name.value if isinstance(column.name, Token)
-                                  else str(column.name)) + "=" + c.value if isinstance(c, Token) else str(c))
-                )
-            relation = relation.dropna()
-        # FIXME This has corner cases where the sep and escapechar can make incorrect values print out
-        return "  " + relation.to_csv(
-            index=False, header=False, sep='#', line_terminator='\n  ', quoting=csv.QUOTE_NONE, escapechar="\\"
-        ).rstrip().replace("'#", "', ").replace('\\ ', ' ')
-
-    def _str_worker(self, proc: int, query: datalog_parser.Query, results: dict):
-        """
-        Since print_relation is the most computationally heavy function, handle each query's print_relation in it's
-        own process and save the results to a multi-threading dictionary.
-        :param query:
-        :param results:
-        """
-        result = str(query) + "? "
-        if self.rdbms[query] is SINGLE_MATCH:
-            result += "Yes(1)\n"
-        elif self.rdbms[query] is None or self.rdbms[query].empty:
-            result += "No\n"
-        else:
-            result += "Yes({})\n{}\n".format(len(self.rdbms[query]), self.print_relation(self.rdbms[query]))
-        results[proc] = result
+    def decode(relation: Relation, named: bool = True) -> Relation:
+        """
+        :param named: If the columns are named by the symbols of variables rather than numbered
+        :return: The relation with the text of its symbols, to show in traces
+        """
+        if isinstance(relation, ColumnRelation):
+            relation = Relation(relation.values, columns=list(relation)).applymap(lambda s: None if s < 0 else s)
+        relation = relation.applymap(lambda s: SYMBOLS[int(s)] if s is not None and s == s else s)
+        if named:
+            relation.columns = [SYMBOLS[c] if isinstance(c, (int, np.integer)) and c >= 0 else str(c) for c in relation]
+        return relation
 
-    def __str__(self) -> str:
+    @staticmethod
+    def sort_rows(symbols: np.ndarray) -> np.ndarray:
         """
-        This is the same as printing a relational database except we will also print the passes
-        :return:
+        Sort rows of symbols by their text.
+        The rank of each symbol is its place in the sorted text, and the ranks of a row are one number in base
+        len(SYMBOLS) when that fits in an int64, so that the rows are sorted once instead of once per column
         """
-        manager = multiprocessing.Manager()
-        results = manager.dict()
-        result = ""
-        jobs = []
-        for i, query in enumerate(self.rdbms.keys()):
-            p = multiprocessing.Process(target=self._str_worker, args=(i, query, results))
-            jobs.append(p)
-            p.start()
-        for proc in jobs:
-            proc.join()
-        for i, _ in enumerate(self.rdbms.keys()):
-            result += results[i]
-        return result
+        ranks = SYMBOLS.ranks()[symbols]
+        width = symbols.shape[1]
+        if len(SYMBOLS) ** width >= 1 << 63:
+            return symbols[np.lexsort(ranks.T[::-1])]
+        powers = np.array([len(SYMBOLS) ** (width - 1 - i) for i in range(width)], dtype=np.int64)
+        return symbols[np.argsort(ranks @ powers, kind='mergesort')]
 
+    @staticmethod
+    def format_lines(relation: Relation, named: bool = True, chunk_size: int = CHUNK_SIZE) -> Iterator[np.ndarray]:
+        """
+        The symbols of the relation are only decoded here, after the rows are sorted, and only chunk_size rows at a
+        time
+        :param named: If the columns are named by the symbols of variables rather than numbered
+        :return: Arrays of the lines of the sorted rows, without their indentation
+        """
+        if relation.empty:
+            return
+        names, symbols = RDBMS.sorted_rows(relation, named)
+        for start in range(0, len(symbols), chunk_size):
+            yield format_rows(names, symbols[start:start + chunk_size])
 
-if __name__ == "__main__":
+    @staticmethod
+    def sorted_rows(relation: Relation, named: bool = True) -> Tuple[List[str], np.ndarray]:
+        """
+        :param named: If the columns are named by the symbols of variables rather than numbered
+        :return: The name that starts each column of a line, and the symbols of the rows with values in sorted order
+        """
+        relation = relation.dropna()
+        names = [(SYMBOLS[c] if named else str(c)) + "=" for c in relation]
+        return names, RDBMS.sort_rows(relation.values.astype(np.int64))
+
+    @staticmethod
+    def print_relation(relation: Relation, named: bool = True) -> str:
+        """
+        :param named: If the columns are named by the symbols of variables rather than numbered
+        """
+        return "  " + "\n  ".join(chain.from_iterable(RDBMS.format_lines(relation, named)))
+
+    def format_tasks(self, queries: Iterable[datalog_parser.Query]) -> Iterator[FormatTask]:
+        """
+        Split the answers to the queries into pieces that are formatted on their own, in the order they are printed.
+        Rows are sorted here so that each piece is only CHUNK_SIZE rows that can be formatted anywhere
+        """
+        for query in queries:
+            result = self.rdbms[query]
+            header = str(query) + "? "
+            if result is SINGLE_MATCH:
+                yield header + "Yes(1)\n", None, None
+            elif result is None or result.empty:
+                yield header + "No\n", None, None
+            else:
+                header += "Yes({})\n".format(len(result))
+                names, symbols = self.sorted_rows(result)
+                # A result whose rows are all missing values is still written as an empty line
+                for start in range(0, max(len(symbols), 1), CHUNK_SIZE):
+                    yield header, names, symbols[start:start + CHUNK_SIZE]
+                    header = ""
+
+    def write_result(self, stream: TextIO, query: datalog_parser.Query):
+        """
+        Write the answer to a query as it is printed, a chunk of rows at a time
+        """
+        for task in self.format_tasks([query]):
+            stream.write(format_chunk(task))
+
+    def write_header(self, stream: TextIO):
+        """
+        Write what is printed before the answers to the queries, which is nothing for a relational database
+        """
+
+    def write_results(self, stream: TextIO, workers: int = None):
+        """
+        Write the header and then the answers to all of the queries, in the order they were asked.
+        Only one chunk of rows is formatted at a time, so the output is never all in memory at once.
+        Large answers are formatted by a pool of processes, which keeps a batch of chunks ahead of the one being
+        written
+        :param workers: The number of processes to format answers in, or the number of CPUs
+        """
+        self.write_header(stream)
+        workers = workers or multiprocessing.cpu_count()
+        rows = sum(len(result) for result in self.rdbms.values() if isinstance(result, self.relation_type))
+        tasks = self.format_tasks(self.rdbms.keys())
+        if workers < 2 or rows < PARALLEL_ROWS or 'fork' not in multiprocessing.get_all_start_methods():
+            chunks = map(format_chunk, tasks)
+        else:
+            logger.info("Formatting {} rows in {} processes".format(rows, workers))
+            chunks = format_pool(workers).imap(format_chunk, tasks, chunksize=FORMAT_BATCH)
+        for chunk in chunks:
+            stream.write(chunk)
+
+    def __str__(self) -> str:
+        stream = StringIO()
+        self.write_results(stream)
+        return stream.getvalue()
+
+
+def main(database: type, description: str, lab_logger: logging.Logger = logger,
+         save_help: str = "Save a snapshot of the relations"):
+    """
+    Run a lab from the command line: parse a datalog file, build a database of it and print the answers to its queries
+    :param database: RDBMS or a subclass of it to answer the queries with
+    :param description: The description of the lab in its usage
+    :param lab_logger: The logger of the lab, which --debug sets the level of
+    :param save_help: What --save saves
+    """
+    import sys
     from argparse import ArgumentParser
 
-    arg = ArgumentParser(description="Run the datalog parser, this will produce output for lab 2")
+    arg = ArgumentParser(description=description)
     arg.add_argument('-d', '--debug', help="The logging debug level to use", default=logging.NOTSET, metavar='LEVEL')
+    arg.add_argument('-e', '--engine', help="The way to store relations", choices=ENGINES, default=ENGINE)
+    arg.add_argument('-q', '--query-cache', help="The number of bytes of query results to cache", type=int,
+                     default=QUERY_CACHE_SIZE, metavar='BYTES')
+    arg.add_argument('-j', '--jobs', type=int, default=0, metavar='N',
+                     help="Format large answers in this many processes at once, 0 uses every CPU")
+    arg.add_argument('-l', '--load', help="Load the relations from a snapshot instead of the facts", metavar='SNAPSHOT')
+    arg.add_argument('-s', '--save', help=save_help, metavar='SNAPSHOT')
+    arg.add_argument('-f', '--facts', help="Import the rows of a CSV or TSV file into a scheme as facts",
+                     action='append', type=fact_import.scheme_file, default=[], metavar='SCHEME=FILE')
     arg.add_argument('file', help='datalog file to parse')
     args = arg.parse_args()
 
     logging.basicConfig(level=logging.ERROR)
-    logger.setLevel(int(args.debug))
+    lab_logger.setLevel(int(args.debug))
+    tracing.configure()
+
+    lab_logger.info("Detected {} CPUs".format(multiprocessing.cpu_count()))
+    lab_logger.debug("Parsing '%s'" % args.file)
 
-    logger.debug("Parsing '%s'" % args.file)
+    # The snapshot is loaded before the program is parsed so that its columns keep their symbols and aren't copied
+    snapshot = None
+    try:
+        snapshot = relation_store.load(args.load) if args.load else None
+    except relation_store.SnapshotError as e:
+        print("Failure!\n  {}".format(e))
+        sys.exit(1)
 
     # Create class objects
-    tokens = lexical_analyzer.scan(args.file)
     datalog = None
     try:
-        datalog = datalog_parser.DatalogProgram(tokens)
+        datalog = parse_cache.parse(args.file)
     except TokenError as t:
         print("Failure!\n  {}".format(t))
-        exit(1)
+        sys.exit(1)
 
-    print(RDBMS(datalog))
+    try:
+        rdbms = database(datalog, engine=args.engine, query_cache_size=args.query_cache, snapshot=snapshot,
+                         fact_files=args.facts)
+    except (OSError, ValueError) as e:
+        print("Failure!\n  {}".format(e))
+        sys.exit(1)
+    if args.save:
+        rdbms.save(args.save)
+    lab_logger.info("Query cache: {}".format(rdbms.query_cache))
+    lab_logger.info("Statistics:\n{}".format(rdbms.catalog))
+    rdbms.write_results(sys.stdout, workers=args.jobs)
+    print()
+
+
+if __name__ == "__main__":
+    main(RDBMS, "Run the datalog parser, this will produce output for lab 2")
@@ -1,23 +1,26 @@
 #!/usr/bin/env python3
 import logging
-import multiprocessing
 
 from collections import defaultdict
-from typing import List
+from typing import List, Sequence, TextIO, Tuple
 from orderedset._orderedset import OrderedSet
 
-import lexical_analyzer
+import relation_store
+import relational_database
 from datalog_interpreter import DatalogInterpreter
 from datalog_parser import DatalogProgram, Rules, Rule
-from tokens import TokenError
+from tracing import Trace
 
 logger = logging.getLogger(__name__)
+trace = Trace(logger, 'optimizer')
 
 
-class Vertex(Rule, set):
+class Vertex(set):
+    """
+    The rules that a rule affects, by their index in the rules
+    """
     def __init__(self, rule: Rule, index: int, rules: Rules):
-        Rule.__init__(self, head=rule.head, predicates=rule.predicates)
-        set.__init__(self)
+        super().__init__()
         self.rule = rule
         self.id = index
         self.rules = rules
@@ -50,7 +53,7 @@ class Vertex(Rule, set):
 class DependencyGraph(defaultdict):
     def __init__(self, rules: Rules):
         super().__init__(list)
-        logger.debug("Rules:\n" + str("\n".join(str(x) for x in rules.rules)) + "\n")
+        trace('rules', lambda: "Rules:\n" + str("\n".join(str(x) for x in rules.rules)) + "\n")
         post_order_traversal = OrderedSet()
 
         # Each rule is assigned a unique ID
@@ -62,12 +65,12 @@ class DependencyGraph(defaultdict):
         # Find strongly connected components
         self.scc = self.get_scc(post_order_traversal)
 
-        logger.debug("Dependency Graph:\n{}".format(self))
-        logger.debug("Reverse Forest:\n{}".format(reversed(self)))
-        logger.debug("Post Order Traversal:\n{}\n".format(
+        trace('dependency_graph', "Dependency Graph:\n{}", self)
+        trace('reverse_forest', lambda: "Reverse Forest:\n{}".format(reversed(self)))
+        trace('post_order', lambda: "Post Order Traversal:\n{}\n".format(
             "\n".join("POTN(R{}) = {}".format(p, i) for i, p in enumerate(post_order_traversal)))
         )
-        logger.debug("Strongly Connected Components:\n{}\n".format(
+        trace('scc', lambda: "Strongly Connected Components:\n{}\n".format(
             "\n".join("{" + str(",".join("R{}".format(v) for v in x)) + "}" for x in self.scc))
         )
 
@@ -101,8 +104,15 @@ class DependencyGraph(defaultdict):
 
 
 class RuleOptimizer(DatalogInterpreter):
-    def __init__(self, datalog_program: DatalogProgram):
-        super().__init__(datalog_program, least_fix_point=False)
+    def __init__(self, datalog_program: DatalogProgram, engine: str = relational_database.ENGINE,
+                 query_cache_size: int = relational_database.QUERY_CACHE_SIZE,
+                 snapshot: relation_store.Snapshot = None, fact_files: Sequence[Tuple[str, str]] = ()):
+        """
+        :param snapshot: Relations to use instead of the facts, the rules are always evaluated to show their passes
+        :param fact_files: Pairs of the name of a scheme and a CSV or TSV file of more facts to import into it
+        """
+        super().__init__(datalog_program, least_fix_point=False, engine=engine, query_cache_size=query_cache_size,
+                         snapshot=snapshot, fact_files=fact_files)
 
         self.dependency_graph = DependencyGraph(datalog_program.rules)
         # Evaluate the rules in the order described by the rule optimizer
@@ -117,57 +127,24 @@ class RuleOptimizer(DatalogInterpreter):
         for c in scc:
             first = c[0]
             if len(c) == 1 and first not in self.dependency_graph[first]:
-                logger.debug("Evaluating not strongly connected {}".format("R{}".format(first)))
+                trace('rule', "Evaluating not strongly connected R{}", first)
                 rule = self.dependency_graph[first].rule
                 self.evaluate_rule(rule)
                 str_passes += "1 passes: R{}\n".format(first)
                 continue
 
-            logger.debug("Evaluating Strongly Connected {}".format(",".join("R{}".format(s) for s in c)))
+            trace('scc', lambda: "Evaluating Strongly Connected {}".format(",".join("R{}".format(s) for s in c)))
             passes = self.evaluate_rules([self.dependency_graph[r].rule for r in c])
             str_passes += "{} passes: {}\n".format(passes, ",".join("R{}".format(s) for s in sorted(c)))
         return str_passes
 
-    def __str__(self):
-        logger.debug("Generating String from Rule Optimizer")
-        result = "Dependency Graph\n{}{}".format(self.dependency_graph, "\n" if self.rules else "")
-        result += "Rule Evaluation\n{}\n".format(self.rule_evaluation)
-        result += "Query Evaluation\n"
-        manager = multiprocessing.Manager()
-        results = manager.dict()
-        jobs = []
-        for i, query in enumerate(self.rdbms.keys()):
-            p = multiprocessing.Process(target=self._str_worker, args=(i, query, results))
-            jobs.append(p)
-            p.start()
-        for proc in jobs:
-            proc.join()
-        for i, _ in enumerate(self.rdbms.keys()):
-            result += str(results[i])
-        return result
+    def write_header(self, stream: TextIO):
+        trace('str', "Writing the results of the Rule Optimizer")
+        stream.write("Dependency Graph\n{}{}".format(self.dependency_graph, "\n" if self.rules else ""))
+        stream.write("Rule Evaluation\n{}\n".format(self.rule_evaluation))
+        stream.write("Query Evaluation\n")
 
 
 if __name__ == "__main__":
-    from argparse import ArgumentParser
-
-    arg = ArgumentParser(description="Run the Rule Optimizer.  This consumes the previous labs.")
-    arg.add_argument('-d', '--debug', help="The logging debug level to use", default=logging.NOTSET, metavar='LEVEL')
-    arg.add_argument('file', help='datalog file to parse')
-    args = arg.parse_args()
-
-    logging.basicConfig(level=logging.ERROR)
-    logger.setLevel(int(args.debug))
-
-    logger.info("Detected {} CPUs".format(multiprocessing.cpu_count()))
-    logger.debug("Parsing '%s'" % args.file)
-
-    # Create class objects
-    tokens = lexical_analyzer.scan(args.file)
-    datalog = None
-    try:
-        datalog = DatalogProgram(tokens)
-    except TokenError as t:
-        print("Failure!\n  {}".format(t))
-        exit(1)
-
-    print(RuleOptimizer(datalog))
+    relational_database.main(RuleOptimizer, "Run the Rule Optimizer.  This consumes the previous labs.", logger,
+                             save_help="Save a snapshot of the relations of the facts")
@@ -11,11 +11,13 @@ from subprocess import check_output
 
 import lexical_analyzer
 import datalog_parser
+import parse_cache
 import relational_database
 import datalog_interpreter
 import rule_optimizer
+import tracing
 
-from tokens import TokenError
+from tokens import TokenBuffer, TokenError
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.ERROR)
@@ -66,22 +68,21 @@ class Sandbox(QWidget):
         self.textbox_input = None
         self.text_input = None
         self.button_toggle = None
+        # Tokens from the last time the input was analyzed, keyed by the ignore_whitespace/ignore_comments options used,
+        # and the edit made to the input since then so that only the edited text needs to be lexed again
+        self.tokens = dict()
+        self.edit = None
         self.initUI()
         self.analyzeInput()
 
-        # TODO import each file as a datalog program and add it to the master datalog program
-        input_datalog = None
+        input_programs = []
         for i in input_files:
-            tokens = lexical_analyzer.scan(i)
             try:
-                new_datalog = datalog_parser.DatalogProgram(tokens)
-                if input_datalog is None:
-                    input_datalog = new_datalog
-                else:
-                    input_datalog += new_datalog
+                input_programs.append(parse_cache.parse(i))
             except TokenError as t:
                 logger.debug(t)
         # Combine all the input files into a single datalog program
+        input_datalog = datalog_parser.DatalogProgram.merge(input_programs) if input_programs else None
         self.textbox_input.appendPlainText(input_datalog.print_datalog_file() if input_datalog else '')
 
     def initUI(self):
@@ -93,6 +94,7 @@ class Sandbox(QWidget):
         # TODO add line numbers to the left side
         # TODO use vim keybindings
         self.textbox_input = QPlainTextEdit(self)
+        self.textbox_input.document().contentsChange.connect(self.recordEdit)
         self.textbox_input.textChanged.connect(self.analyzeInput)
 
         splitter_text.addWidget(self.textbox_input)
@@ -194,12 +196,18 @@ class Sandbox(QWidget):
             with open(temp_file, 'w+') as temp:
                 temp.write(textbox_value)
 
+            # Only tokens lexed from this input can be re-lexed after the next edit
+            previous_tokens, edit = self.tokens, self.edit
+            self.tokens, self.edit = dict(), None
+
             # Run the lexical analyzer and print output
             if self.data[1]['checkbox'].checkState():
-                tokens = lexical_analyzer.scan(
-                    input_data=textbox_value,
-                    ignore_whitespace=self.check_whitespace.checkState(),
-                    ignore_comments=self.check_comments.checkState()
+                tokens = self.lexInput(
+                    textbox_value,
+                    previous_tokens,
+                    edit,
+                    ignore_whitespace=bool(self.check_whitespace.checkState()),
+                    ignore_comments=bool(self.check_comments.checkState())
                 )
                 self.data[1]['expected output'].append("\n".join(str(t) for t in tokens))
                 self.data[1]['expected output'].append("Total Tokens = %s\n" % len(tokens))
@@ -211,13 +219,15 @@ class Sandbox(QWidget):
 
             # Run the datalog parser and print output
             if any(self.data[i]['checkbox'].checkState() for i in [2, 3, 4, 5]):
-                d_tokens = lexical_analyzer.scan(input_data=textbox_value, ignore_comments=True, ignore_whitespace=True)
+                d_tokens = self.lexInput(textbox_value, previous_tokens, edit, ignore_comments=True,
+                                          ignore_whitespace=True)
                 if self.data[2].get('binary', None):
                     command = "./{} {}".format(self.data[2]['binary'], temp_file)
                     self.data[2]['actual output'].append(
                         str(check_output(command, shell=True, timeout=2), 'utf-8')
                     )
                 try:
+                    # The input changes with every edit, so it isn't worth caching
                     datalog = datalog_parser.DatalogProgram(d_tokens)
                     self.data[2]['expected output'].append("Success!\n{}".format(datalog))
 
@@ -249,6 +259,52 @@ class Sandbox(QWidget):
                     for i in range(2, 5 + 1):
                         self.data[i]['expected output'].append('Failure\n {}'.format(t))
 
+    def recordEdit(self, position: int, removed: int, added: int):
+        """
+        Remember the range of the input that changed since it was last analyzed.
+        Edits made while paused are merged into one range that covers all of them.
+        :param position: The offset where the edit starts
+        :param removed: The number of characters removed
+        :param added: The number of characters inserted
+        """
+        if self.edit is None:
+            self.edit = (position, removed, added)
+            return
+        start, previous_removed, previous_added = self.edit
+        # The end of the merged edit, first in the current text and then in the text before both edits
+        end = max(start + previous_added, position + removed)
+        self.edit = (
+            min(start, position),
+            end - previous_added + previous_removed - min(start, position),
+            end + added - removed - min(start, position)
+        )
+
+    def lexInput(self, text: str, previous_tokens: dict, edit: tuple or None, ignore_whitespace: bool,
+                 ignore_comments: bool) -> TokenBuffer:
+        """
+        Lex the input, only re-lexing the edited part of it if it was lexed the same way last time
+        :param text: The current input
+        :param previous_tokens: The tokens from the last time the input was analyzed
+        :param edit: The edit made to the input since it was last analyzed
+        :return: The tokens of the input
+        """
+        key = (ignore_whitespace, ignore_comments)
+        tokens = self.tokens.get(key)
+        if tokens is not None:
+            return tokens
+
+        previous = previous_tokens.get(key)
+        if previous is not None and edit is None and len(previous.source) == len(text):
+            tokens = previous
+        elif previous is not None and edit is not None and len(previous.source) - edit[1] + edit[2] == len(text):
+            tokens = lexical_analyzer.rescan(previous, text, *edit, ignore_whitespace=ignore_whitespace,
+                                             ignore_comments=ignore_comments)
+        else:
+            tokens = lexical_analyzer.scan(input_data=text, ignore_whitespace=ignore_whitespace,
+                                           ignore_comments=ignore_comments)
+        self.tokens[key] = tokens
+        return tokens
+
     def toggleParse(self):
         if self.state == self.PAUSED:
             self.state = self.RUNNING
@@ -292,6 +348,7 @@ if __name__ == '__main__':
 
     # Setup debugger
     logger.setLevel(int(args.debug))
+    tracing.configure()
 
     # Start application
     sandbox = Sandbox(input_files=args.test_files, lab1_binary=args.lab_1, lab2_binary=args.lab_2,
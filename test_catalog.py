@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import os
+import unittest
+
+from tempfile import NamedTemporaryFile
+
+import datalog_parser
+import lexical_analyzer
+
+from catalog import Catalog, RelationStatistics
+from column_store import ColumnRelation, symbol_columns
+from datalog_interpreter import DatalogInterpreter
+from tokens import SYMBOLS
+
+PROGRAM = """
+Schemes:
+    edge(a,b)
+    path(a,b)
+    hop(a,b,c)
+Facts:
+    edge('1','2'). edge('2','3'). edge('3','4'). edge('2','3'). edge('4','2').
+Rules:
+    path(X,Y) :- edge(X,Y).
+    path(X,Z) :- edge(X,Y), path(Y,Z).
+    hop(X,Y,Z) :- edge(X,Y), edge(Y,Z).
+Queries:
+    path('1',X)?
+    hop(X,Y,X)?
+"""
+
+
+def parse(text: str) -> datalog_parser.DatalogProgram:
+    return datalog_parser.DatalogProgram(lexical_analyzer.scan(input_data=text))
+
+
+class ReadingInterpreter(DatalogInterpreter):
+    """
+    Reads the statistics of every relation that a rule changes, so that they are counted on every pass
+    """
+    def union(self, head: datalog_parser.headPredicate, relation) -> bool:
+        changed = super().union(head, relation)
+        self.catalog.get(head.id.symbol)
+        return changed
+
+
+class TestCatalog(unittest.TestCase):
+    def assertCounted(self, catalog: Catalog, symbol: int, relation):
+        """
+        The statistics of the relation are the same as counting all of its rows again
+        """
+        columns = symbol_columns(relation)
+        expected = RelationStatistics(len(columns))
+        expected.add(columns)
+        actual = catalog[symbol]
+        self.assertEqual(actual.rows, expected.rows)
+        self.assertEqual(len(actual.columns), len(expected.columns))
+        for counted, recounted in zip(actual.columns, expected.columns):
+            self.assertEqual(counted.symbols.tolist(), recounted.symbols.tolist())
+            self.assertEqual(counted.counts.tolist(), recounted.counts.tolist())
+            self.assertEqual(counted.missing, recounted.missing)
+
+    def assertAllCounted(self, interpreter: DatalogInterpreter):
+        for symbol, relation in interpreter.relations.items():
+            self.assertCounted(interpreter.catalog, symbol, relation)
+
+    def test_rules(self):
+        """
+        The relations that the rules change are extended on every pass, whether their statistics are read between the
+        passes or only at the end
+        """
+        for interpreter_type in (DatalogInterpreter, ReadingInterpreter):
+            for engine in ('numpy', 'pandas'):
+                with self.subTest(interpreter=interpreter_type.__name__, engine=engine):
+                    self.assertAllCounted(interpreter_type(parse(PROGRAM), engine=engine))
+
+    def test_import_facts(self):
+        """
+        Imported rows that are already facts aren't counted twice, and the rules extend the relation again after them
+        """
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as fact_file:
+            fact_file.write("1,2\n4,5\n5,1\n4,5\n")
+        try:
+            for engine in ('numpy', 'pandas'):
+                with self.subTest(engine=engine):
+                    interpreter = DatalogInterpreter(parse(PROGRAM), engine=engine)
+                    interpreter.import_facts('edge', fact_file.name)
+                    self.assertAllCounted(interpreter)
+                    interpreter.evaluate_rules()
+                    self.assertAllCounted(interpreter)
+        finally:
+            os.remove(fact_file.name)
+
+    def test_extend(self):
+        """
+        Rows added by several unions before the statistics are read are counted once, and a relation that doesn't
+        start with the rows that were counted is counted again
+        """
+        catalog = Catalog()
+        first, second = SYMBOLS.intern('first'), SYMBOLS.intern('second')
+        relation = ColumnRelation([[1, 2], [3, 4]])
+        catalog.count(first, relation)
+        self.assertCounted(catalog, first, relation)
+        for rows in ([[2, 5], [4, 6]], [[7], [3]], [[1, 2], [3, 4]]):
+            united = relation.union(ColumnRelation(rows))
+            catalog.extend(first, united, len(relation))
+            relation = united
+        self.assertCounted(catalog, first, relation)
+
+        # The rows counted before aren't the first rows of this relation
+        relation = ColumnRelation([[9, 1], [9, 3]])
+        catalog.extend(first, relation, 1)
+        self.assertCounted(catalog, first, relation)
+        # Nor are the rows of the relation that was extended before it, which weren't counted yet
+        catalog.extend(first, relation.union(ColumnRelation([[8], [8]])), len(relation))
+        relation = ColumnRelation([[1, 2, 6], [3, 4, 6]])
+        catalog.extend(first, relation, 1)
+        self.assertCounted(catalog, first, relation)
+
+        # Rows that may have duplicates are counted again when the relation is extended
+        duplicates = ColumnRelation([[1, 1], [2, 2]])
+        catalog.count(second, duplicates, unique=False)
+        self.assertCounted(catalog, second, duplicates)
+        relation = duplicates.union(ColumnRelation([[3], [4]]))
+        catalog.extend(second, relation, len(duplicates))
+        self.assertCounted(catalog, second, relation)
+
+
+if __name__ == '__main__':
+    unittest.main()
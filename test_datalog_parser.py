@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import unittest
+
+import datalog_parser
+import datalog_interpreter
+import lexical_analyzer
+import relational_database
+
+from tokens import SYMBOLS, TokenError, TokenType
+
+SCHEMES = "Schemes: g(a,b,c) Facts: Rules: Queries: "
+
+
+def parse(text: str) -> datalog_parser.DatalogProgram:
+    return datalog_parser.DatalogProgram(lexical_analyzer.scan(input_data=text))
+
+
+class TestErrors(unittest.TestCase):
+    def assertFailsAt(self, query: str, t_type: TokenType, value: str):
+        with self.assertRaises(TokenError) as error:
+            parse(SCHEMES + query)
+        token = error.exception.args[0]
+        self.assertEqual((token.type, token.value), (t_type, value), query)
+
+    def test_malformed_expressions(self):
+        """
+        An expression that doesn't match is reported on the LEFT_PAREN that opens it, however deeply it failed, the
+        same as the grammar interpreter that the predictive parser replaced
+        """
+        self.assertFailsAt("g(('3.5'),'2','1')?", TokenType.LEFT_PAREN, "(")
+        self.assertFailsAt("g((A+(B*)),C)?", TokenType.LEFT_PAREN, "(")
+        self.assertFailsAt("g(((A+B)+C D),E)?", TokenType.LEFT_PAREN, "(")
+        # Once an expression has matched, the error is whatever is expected after it
+        self.assertFailsAt("g((A+B)?", TokenType.Q_MARK, "?")
+        self.assertFailsAt("g((A+'1'),(B*$))?", TokenType.COMMA, ",")
+        self.assertFailsAt("g(A,((B+C)*(D+E)+F))?", TokenType.COMMA, ",")
+
+    def test_well_formed_expressions(self):
+        program = parse(SCHEMES + "g((A+B),(C*(D+'1')),E)?")
+        self.assertEqual(str(program.queries.queries[0]), "g((A+B),(C*(D+'1')),E)")
+
+
+class TestExpressions(unittest.TestCase):
+    def test_no_operator(self):
+        """
+        An expression without an operator parses, and the query skips it with a warning when it is compiled
+        """
+        program = parse("Schemes: f(a,b) Facts: f('1','2'). f('3','4'). Rules: Queries: f((A B),B)?")
+        query = program.queries.queries[0]
+        self.assertEqual(str(query), "f((AB),B)")
+        self.assertIsNone(query.parameterList[0].expression.operator)
+        with self.assertLogs(relational_database.logger, 'WARNING'):
+            rdbms = relational_database.RDBMS(program)
+        self.assertEqual(rdbms.print_relation(rdbms.rdbms[query]), "  B='2'\n  B='4'")
+
+
+class TestMerge(unittest.TestCase):
+    PROGRAMS = [
+        "Schemes: f(a,b) g(a) Facts: f('1','2'). g('x'). f('1','2'). f('2','3'). "
+        "Rules: g(X) :- f(X,Y). Queries: g(X)?",
+        "Schemes: g(a) h(a,b) Facts: g('x'). h('2','x'). f('2','3'). g('y'). "
+        "Rules: h(X,Y) :- f(X,Z), g(Y). g(X) :- f(X,Y). Queries: h(X,'x')? g(X)?",
+        "Schemes: f(a,b) Facts: Rules: f(X,Y) :- h(X,Y). Queries: f('2',X)?",
+        "Schemes: h(a,b) Facts: h('3','z'). f('3','1'). Rules: Queries: f(X,Y)?",
+        "Schemes: g(a) Facts: g('z'). g('x'). Rules: g(X) :- f(X,Y). Queries: g(X)?",
+    ]
+
+    def test_duplicate_facts(self):
+        """
+        Facts are merged in order keeping the first of each, whether they were parsed in bulk or created one at a time,
+        and a tree reduction merges them the same as merging them all at once
+        """
+        programs = [parse(text) for text in self.PROGRAMS]
+        expected = list(dict.fromkeys(str(fact) for program in programs for fact in program.facts.facts))
+        for workers in (1, 2, 3):
+            with self.subTest(workers=workers):
+                merged = datalog_parser.DatalogProgram.merge(programs, workers=workers)
+                self.assertEqual([str(fact) for fact in merged.facts.facts], expected)
+
+        one_at_a_time = [datalog_parser.Facts(program.facts.facts) for program in programs]
+        facts = datalog_parser.Facts.merge(one_at_a_time[:2] + [program.facts for program in programs[2:]])
+        self.assertEqual([str(fact) for fact in facts.facts], expected)
+        reference = datalog_parser.Facts([fact for program in programs for fact in program.facts.facts])
+        self.assertEqual(set(facts.domain), set(reference.domain))
+        for name, columns in facts.columns.items():
+            self.assertEqual(len(set(zip(*columns))), len(columns[0]), name)
+            self.assertEqual(set(zip(*columns)), set(zip(*reference.columns[name])), name)
+        self.assertEqual(len(datalog_parser.Facts.merge([]).facts), 0)
+
+    def test_clashing_schemes(self):
+        """
+        A scheme with the same name as an earlier one but another number of attributes is dropped with a warning, and
+        facts with a different number of strings are padded
+        """
+        programs = [parse("Schemes: f(a,b) Facts: f('1','2'). Rules: Queries: f(X,Y)?"),
+                    parse("Schemes: f(a,b,c) Facts: f('1','2','3'). f('1','2'). Rules: Queries: f(X,Y)?")]
+        with self.assertLogs(datalog_parser.logger, 'WARNING'):
+            merged = datalog_parser.DatalogProgram.merge(programs)
+        self.assertEqual([str(scheme) for scheme in merged.schemes.schemes], ["f(a,b)"])
+        self.assertEqual([str(fact) for fact in merged.facts.facts], ["f('1','2').", "f('1','2','3')."])
+        self.assertEqual([column.tolist() for column in merged.facts.columns['f']][2], [-1, SYMBOLS.intern("'3'")])
+        self.assertEqual([str(query) for query in merged.queries.queries], ["f(X,Y)"])
+
+    def test_mixed_rules(self):
+        """
+        Rules and queries that print the same are only kept once, and the merged program answers the same as one
+        program written with all of the schemes, facts, rules and queries
+        """
+        merged = datalog_parser.DatalogProgram.merge([parse(text) for text in self.PROGRAMS])
+        self.assertEqual([str(rule) for rule in merged.rules.rules],
+                         ["g(X) :- f(X,Y).", "h(X,Y) :- f(X,Z),g(Y).", "f(X,Y) :- h(X,Y)."])
+        self.assertEqual([str(query) for query in merged.queries.queries],
+                         ["g(X)", "h(X,'x')", "f('2',X)", "f(X,Y)"])
+        combined = parse("Schemes: f(a,b) g(a) h(a,b) "
+                         "Facts: f('1','2'). g('x'). f('2','3'). h('2','x'). g('y'). h('3','z'). f('3','1'). g('z'). "
+                         "Rules: g(X) :- f(X,Y). h(X,Y) :- f(X,Z), g(Y). f(X,Y) :- h(X,Y). "
+                         "Queries: g(X)? h(X,'x')? f('2',X)? f(X,Y)?")
+        self.assertEqual(str(datalog_interpreter.DatalogInterpreter(merged)),
+                         str(datalog_interpreter.DatalogInterpreter(combined)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,14 +4,13 @@ from argparse import ArgumentParser
 from enum import Enum
 
 from lizard import analyze_file, FunctionInfo
-from os import path as os_path, name as os_name, listdir
+from os import path as os_path, name as os_name, listdir, remove
 from subprocess import TimeoutExpired, check_output, check_call, CalledProcessError, PIPE
 from sys import argv, exit as sys_exit
 from tempfile import NamedTemporaryFile
 
 from datalog_interpreter import DatalogInterpreter
-from lexical_analyzer import scan as lexical_scan
-from datalog_parser import DatalogProgram
+from lexical_analyzer import scan_iter as lexical_scan
 from relational_database import RDBMS
 from rule_optimizer import RuleOptimizer
 from time import time
@@ -19,9 +18,14 @@ from tokens import TokenError
 
 import unittest
 import logging
+import parse_cache
+import tracing
 
 logger = logging.getLogger(__name__)
 
+# The number of characters of the test driver's output that are read and compared at a time
+COMPARE_CHUNK = 1 << 16
+
 
 class Message(Enum):
     TIMEOUT = "Timeout"
@@ -50,6 +54,7 @@ class TestDriver(unittest.TestCase):
         # Set up the logger
         logging.basicConfig(level=logging.ERROR)
         logger.setLevel(int(args.debug))
+        tracing.configure()
 
         cls.threading = multiprocessing.Manager()
 
@@ -112,10 +117,20 @@ class TestDriver(unittest.TestCase):
                 for proc in jobs:
                     proc.join()
 
-                # Grab the student output from their binary
-                self.assertNotIsInstance(results[self.student], Message,
-                                         "Runtime exceeded {} Seconds, or the program crashed".format(self.timeout))
-                self.assertEqual(results[self.student].strip(),  results[self.__class__].strip())
+                # Labs 3 to 5 streamed their output to a file instead of returning it, which is removed however the
+                # test ends
+                output_file = results.get(str(self.__class__) + "File")
+                try:
+                    # Grab the student output from their binary
+                    self.assertNotIsInstance(results[self.student], Message, "Runtime exceeded {} Seconds, or the "
+                                             "program crashed".format(self.timeout))
+                    if output_file is not None:
+                        self.assertOutputEqual(results[self.student], output_file)
+                    else:
+                        self.assertEqual(results[self.student].strip(),  results[self.__class__].strip())
+                finally:
+                    if output_file is not None:
+                        remove(output_file)
                 student_runtime = results[self.student + "Runtime"]
                 driver_runtime = results[str(self.__class__) + "Runtime"]
                 self.assertLessEqual(
@@ -125,6 +140,27 @@ class TestDriver(unittest.TestCase):
                 )
                 logger.info("Test Passed")
 
+    def assertOutputEqual(self, student: str, output_file: str):
+        """
+        Compare the student's output to the test driver's output file COMPARE_CHUNK characters at a time, ignoring the
+        whitespace around both like the other labs.  The whole file is only read to show the difference if they differ
+        """
+        student = student.strip()
+        position = 0
+        with open(output_file) as output_stream:
+            chunk = output_stream.read(COMPARE_CHUNK).lstrip()
+            while chunk:
+                end = min(len(student), position + len(chunk))
+                if chunk[:end - position] != student[position:end] or chunk[end - position:].strip():
+                    break
+                position = end
+                chunk = output_stream.read(COMPARE_CHUNK)
+            else:
+                if position == len(student):
+                    return
+            output_stream.seek(0)
+            self.assertEqual(student, output_stream.read().strip())
+
     def student_output(self, test_file: str, results: dict):
         start_time = time()
         command = "./{} {}".format(self.binary, test_file)
@@ -142,22 +178,21 @@ class TestDriver(unittest.TestCase):
         start_time = time()
         logger.debug("Running test driver on {}".format(test_file))
         result = ""
-        # TODO Compute the correct output from the python script, detect change by including hash of file in pickle
         # TODO save the correct output to a pickle file to lower my runtime?
         if self.lab == 1:
-            lex = lexical_scan(test_file, ignore_comments=False, ignore_whitespace=True)
-            for line in lex:
+            total_tokens = 0
+            for line in lexical_scan(test_file, ignore_comments=False, ignore_whitespace=True):
                 result += str(line) + "\n"
-            result += "Total Tokens = {}\n".format(len(lex))
+                total_tokens += 1
+            result += "Total Tokens = {}\n".format(total_tokens)
             results[self.__class__] = result
             results[str(self.__class__) + "Runtime"] = time() - start_time
             return
 
-        # The rest of the labs will need tokens with no comments or whitespace
-        tokens = lexical_scan(test_file, ignore_comments=True, ignore_whitespace=True)
+        # The rest of the labs start from the parsed program, which is cached by the hash of the file
         # Ignore traces on token errors
         try:
-            datalog = DatalogProgram(tokens)
+            datalog = parse_cache.parse(test_file)
             if self.lab == 2:
                 results[self.__class__] = "Success!\n{}".format(datalog)
                 results[str(self.__class__) + "Runtime"] = time() - start_time
@@ -168,16 +203,23 @@ class TestDriver(unittest.TestCase):
             return
 
         if self.lab == 3:
-            rdbms = RDBMS(datalog)
+            database = RDBMS(datalog)
             for datalog_query in datalog.queries.queries:
-                rdbms.rdbms[datalog_query] = rdbms.evaluate_query(datalog_query)
-            results[self.__class__] = str(rdbms)
+                database.rdbms[datalog_query] = database.evaluate_query(datalog_query)
         elif self.lab == 4:
-            results[self.__class__] = str(DatalogInterpreter(datalog))
+            database = DatalogInterpreter(datalog)
         elif self.lab == 5:
-            results[self.__class__] = str(RuleOptimizer(datalog))
+            database = RuleOptimizer(datalog)
         else:
             results[self.__class__] = Message.INVALID_LAB
+            results[str(self.__class__) + "Runtime"] = time() - start_time
+            return
+
+        # The results are streamed to a file and compared a chunk at a time, so they are never all in memory
+        with NamedTemporaryFile('w', suffix='.txt', delete=False) as output:
+            database.write_results(output)
+        results[self.__class__] = None
+        results[str(self.__class__) + "File"] = output.name
 
         results[str(self.__class__) + "Runtime"] = time() - start_time
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from glob import glob
+from os import path
+
+import lexical_analyzer
+
+from tokens import TokenBuffer
+
+EXAMPLES = sorted(glob(path.join(path.dirname(path.abspath(__file__)), 'examples', '*.txt')))
+# Text that changes how the text around it lexes when it is inserted: comments, strings and what they could end in
+INSERTS = ["#|", "|#", "#", "'", "''", "\n", ":", "-", " ", "A", "1", "Rules", "(", "?"]
+OPTIONS = [(True, True), (False, False)]
+
+
+def read(example: str) -> str:
+    with open(example) as example_stream:
+        return example_stream.read()
+
+
+def tokens(buffer: TokenBuffer) -> list:
+    return [(token.type, token.value, token.line_number) for token in buffer]
+
+
+class TestLexicalAnalyzer(unittest.TestCase):
+    def test_scan_parallel(self):
+        """
+        Pieces of a few dozen characters split most of the examples in the middle of comments and strings, which
+        scan_parallel has to lex again across the boundaries
+        """
+        for example in EXAMPLES:
+            text = read(example)
+            for ignore_whitespace, ignore_comments in OPTIONS:
+                with self.subTest(example=path.basename(example), ignore_whitespace=ignore_whitespace):
+                    expected = lexical_analyzer.scan(input_data=text, ignore_whitespace=ignore_whitespace,
+                                                     ignore_comments=ignore_comments)
+                    actual = lexical_analyzer.scan_parallel(input_data=text, ignore_whitespace=ignore_whitespace,
+                                                            ignore_comments=ignore_comments, workers=2,
+                                                            chunk_size=37)
+                    self.assertEqual(tokens(actual), tokens(expected))
+
+    def test_scan_iter(self):
+        for example in EXAMPLES:
+            text = read(example)
+            with self.subTest(example=path.basename(example)):
+                expected = lexical_analyzer.scan(input_data=text)
+                self.assertEqual(tokens(lexical_analyzer.scan_iter(input_data=text, chunk_size=7)), tokens(expected))
+
+    def test_rescan(self):
+        """
+        Every example is edited at random offsets by removing some characters and inserting text that opens or
+        closes a comment or a string, and rescan has to produce the same tokens as scanning the edited text
+        """
+        edits = random.Random(0)
+        for example in EXAMPLES:
+            text = read(example)
+            for ignore_whitespace, ignore_comments in OPTIONS:
+                before = lexical_analyzer.scan(input_data=text, ignore_whitespace=ignore_whitespace,
+                                               ignore_comments=ignore_comments)
+                for _ in range(20):
+                    start = edits.randint(0, len(text))
+                    removed = min(edits.choice([0, 0, 1, 5]), len(text) - start)
+                    inserted = edits.choice(INSERTS + [""])
+                    edited = text[:start] + inserted + text[start + removed:]
+                    with self.subTest(example=path.basename(example), edit=(start, removed, inserted),
+                                      ignore_whitespace=ignore_whitespace):
+                        expected = lexical_analyzer.scan(input_data=edited, ignore_whitespace=ignore_whitespace,
+                                                         ignore_comments=ignore_comments)
+                        actual = lexical_analyzer.rescan(before, edited, start, removed, len(inserted),
+                                                         ignore_whitespace=ignore_whitespace,
+                                                         ignore_comments=ignore_comments)
+                        self.assertEqual(tokens(actual), tokens(expected))
+                        # The rest of the buffer has to line up too, so that the result can be rescanned again
+                        self.assertEqual((actual.starts, actual.ends), (expected.starts, expected.ends))
+
+    def test_rescan_twice(self):
+        """
+        The result of rescan is scanned again after a second edit, the way an editor would keep using it
+        """
+        text = read(EXAMPLES[0])
+        buffer = lexical_analyzer.scan(input_data=text)
+        middle = len(text) // 2
+        text = text[:middle] + "#|" + text[middle:]
+        buffer = lexical_analyzer.rescan(buffer, text, middle, 0, 2)
+        text = text[:middle] + text[middle + 2:]
+        buffer = lexical_analyzer.rescan(buffer, text, middle, 2, 0)
+        self.assertEqual(tokens(buffer), tokens(lexical_analyzer.scan(input_data=text)))
+
+
+if __name__ == '__main__':
+    unittest.main()
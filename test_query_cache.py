@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import os
+import unittest
+
+from tempfile import NamedTemporaryFile
+
+import datalog_parser
+import lexical_analyzer
+
+from column_store import ColumnRelation
+from datalog_interpreter import DatalogInterpreter
+from relational_database import QueryCache
+
+PROGRAM = """
+Schemes:
+    edge(a,b)
+    path(a,b)
+Facts:
+    edge('1','2'). edge('2','3'). edge('3','4').
+Rules:
+    path(X,Y) :- edge(X,Y).
+    path(X,Z) :- edge(X,Y), path(Y,Z).
+Queries:
+    path('1',X)?
+    edge(X,Y)?
+"""
+
+
+def parse(text: str) -> datalog_parser.DatalogProgram:
+    return datalog_parser.DatalogProgram(lexical_analyzer.scan(input_data=text))
+
+
+def answer(interpreter: DatalogInterpreter, query: datalog_parser.Query) -> str:
+    return interpreter.print_relation(interpreter.evaluate_query(query))
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_fixed_point(self):
+        """
+        edge never changes, so every rule after the first that asks edge(X,Y)? is answered from the cache.  path
+        changes on every pass but the last, so path(Y,Z)? is answered again on every pass
+        """
+        for engine in ('numpy', 'pandas'):
+            with self.subTest(engine=engine):
+                interpreter = DatalogInterpreter(parse(PROGRAM), engine=engine)
+                cache = interpreter.query_cache
+                # Both queries are asked before and after the rules, and edge(X,Y)? is only a hit the second time
+                self.assertEqual(cache.hits, 2 * interpreter.passes + 1)
+                self.assertEqual(cache.misses, interpreter.passes + 3)
+                self.assertEqual(cache.evictions, 0)
+                self.assertLessEqual(cache.used, cache.size)
+
+    def test_import_facts(self):
+        """
+        Importing facts changes the version of the relation, so its cached results aren't used again, and evaluating
+        the rules again with the new facts answers the queries about the relations they derive from the new rows
+        """
+        program = parse(PROGRAM)
+        path_query, edge_query = program.queries.queries
+        interpreter = DatalogInterpreter(program)
+        self.assertEqual(answer(interpreter, path_query).count("X="), 3)
+        self.assertEqual(answer(interpreter, edge_query).count("X="), 3)
+
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as fact_file:
+            fact_file.write("4,5\n")
+        try:
+            interpreter.import_facts('edge', fact_file.name)
+        finally:
+            os.remove(fact_file.name)
+        misses = interpreter.query_cache.misses
+        self.assertEqual(answer(interpreter, edge_query).count("X="), 4)
+        self.assertEqual(interpreter.query_cache.misses, misses + 1)
+
+        interpreter.evaluate_rules()
+        self.assertEqual(answer(interpreter, path_query).count("X="), 4)
+
+    def test_evictions(self):
+        """
+        Results are evicted least recently used first once they take more than the size of the cache
+        """
+        cache = QueryCache(size=3 * 8)
+        for key in 'abc':
+            cache.put(key, 0, ColumnRelation([[1]]))
+        self.assertIsNotNone(cache.get('a', 0))
+        cache.put('d', 0, ColumnRelation([[1]]))
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get('b', 0))
+        self.assertIsNotNone(cache.get('a', 0))
+        # A result for another version of the relation isn't used
+        self.assertIsNone(cache.get('d', 1))
+        self.assertEqual((cache.hits, cache.misses, cache.used), (2, 2, 3 * 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
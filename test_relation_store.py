@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from os import path
+
+import datalog_parser
+import lexical_analyzer
+import relation_store
+
+from column_store import symbol_columns
+from datalog_interpreter import DatalogInterpreter
+
+PROGRAM = """
+Schemes:
+    edge(a,b)
+    path(a,b)
+    label(a,b)
+Facts:
+    edge('1','2'). edge('2','3'). edge('3','4'). edge('2','3').
+    label('1','start'). label('4','end').
+Rules:
+    path(X,Y) :- edge(X,Y).
+    path(X,Z) :- edge(X,Y), path(Y,Z).
+Queries:
+    path('1',X)?
+    label(X,'end')?
+    label(X,Y)?
+"""
+
+
+def parse(text: str) -> datalog_parser.DatalogProgram:
+    return datalog_parser.DatalogProgram(lexical_analyzer.scan(input_data=text))
+
+
+def rows(relation) -> list:
+    return [column.tolist() for column in symbol_columns(relation)]
+
+
+class TestRelationStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshot = path.join(self.directory, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertRoundTrip(self, interpreter: DatalogInterpreter, snapshot: relation_store.Snapshot):
+        derived = {symbol: relation for symbol, relation in interpreter.relations.items()
+                   if relation is not interpreter.facts.get(symbol)}
+        self.assertEqual(snapshot.passes, interpreter.passes)
+        self.assertEqual(snapshot.program, interpreter.program_key)
+        for saved, relations in ((snapshot.facts, interpreter.facts), (snapshot.derived, derived)):
+            self.assertEqual(set(saved), set(relations))
+            for symbol, relation in relations.items():
+                self.assertEqual(rows(saved[symbol]), rows(relation))
+
+    def test_round_trip(self):
+        """
+        A snapshot loaded by the process that saved it has the same symbols, so its columns are mapped read only
+        instead of being copied, and the program answers the same from them without evaluating its rules
+        """
+        for engine in ('numpy', 'pandas'):
+            with self.subTest(engine=engine):
+                interpreter = DatalogInterpreter(parse(PROGRAM), engine=engine)
+                interpreter.save(self.snapshot)
+                snapshot = relation_store.load(self.snapshot)
+                self.assertRoundTrip(interpreter, snapshot)
+                for relation in list(snapshot.facts.values()) + list(snapshot.derived.values()):
+                    for column in relation.columns:
+                        self.assertFalse(column.flags.writeable)
+
+                restored = DatalogInterpreter(parse(PROGRAM), engine=engine, snapshot=snapshot)
+                self.assertEqual(restored.program_facts, set())
+                self.assertEqual(str(restored), str(interpreter))
+
+    def test_new_symbols(self):
+        """
+        A snapshot saved by another process that interned its values in another order is copied with the symbols of
+        this process
+        """
+        script = "import datalog_parser, lexical_analyzer, sys\n" \
+                 "from datalog_interpreter import DatalogInterpreter\n" \
+                 "from tokens import SYMBOLS\n" \
+                 "SYMBOLS.intern_all(['end', 'only saved', '4', 'path'])\n" \
+                 "program = datalog_parser.DatalogProgram(lexical_analyzer.scan(input_data=sys.stdin.read()))\n" \
+                 "DatalogInterpreter(program).save(sys.argv[1])\n"
+        subprocess.run([sys.executable, '-c', script, self.snapshot], input=PROGRAM, universal_newlines=True,
+                       cwd=path.dirname(path.abspath(__file__)), check=True)
+        interpreter = DatalogInterpreter(parse(PROGRAM))
+        snapshot = relation_store.load(self.snapshot)
+        self.assertRoundTrip(interpreter, snapshot)
+        edge = snapshot.facts[interpreter.schemes['edge'].id.symbol]
+        self.assertTrue(all(column.flags.writeable for column in edge.columns))
+        self.assertEqual(str(DatalogInterpreter(parse(PROGRAM), snapshot=snapshot)), str(interpreter))
+
+    def test_not_a_snapshot(self):
+        with open(path.join(self.directory, 'notes.txt'), 'w') as notes:
+            notes.write("not a snapshot")
+        with self.assertRaises(relation_store.SnapshotError):
+            relation_store.save(self.directory, {})
+        with self.assertRaises(relation_store.SnapshotError):
+            relation_store.load(self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
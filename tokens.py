@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 import logging
 import re
+import threading
 
+from array import array
+from collections.abc import Sequence
 from enum import Enum
+from typing import Dict, List
+
+import numpy as np
+
+from tracing import Trace
 
 logger = logging.getLogger(__name__)
+trace = Trace(logger, 'tokens')
 
 
 class TokenError(Exception):
@@ -37,84 +46,168 @@ class TokenType(Enum):
 
     def match(self, string) -> bool:
         match = self.value.match(string)
-        logger.debug("'{}' {} {}".format(string, "matched" if match else "did not match", self.name))
+        trace('match', "'{string}' {result} {type}", string=string, type=self.name,
+              result="matched" if match else "did not match")
         return match
 
     def __str__(self) -> str:
         return self.name
 
 
+# The same expressions as TokenType without the '^' anchors, ordered by the priority Token gives them.
+# Joining them into a single alternation lets the scanner find the best token at any offset with one match.
+TOKEN_PRIORITY = (
+    (TokenType.COMMENT, r'#[^|][^\n]*|#\|[\s\S]*?\|#'),
+    (TokenType.UNDEFINED, r"#\|[\s\S]*\Z|'(?:''|[^'])+\Z"),
+    (TokenType.STRING, r"'(?:''|[^'])+'|''"),
+    (TokenType.WHITESPACE, r'\s+'),
+    (TokenType.SCHEMES, r'Schemes(?=[^a-zA-z\d]|\Z)'),
+    (TokenType.FACTS, r'Facts(?=[^a-zA-z\d]|\Z)'),
+    (TokenType.QUERIES, r'Queries(?=[^a-zA-z\d]|\Z)'),
+    (TokenType.RULES, r'Rules(?=[^a-zA-z\d]|\Z)'),
+    (TokenType.ID, r'[a-zA-Z][a-zA-Z0-9]*'),
+    (TokenType.COLON_DASH, r':-'),
+    (TokenType.COLON, r':'),
+    (TokenType.COMMA, r','),
+    (TokenType.PERIOD, r'\.'),
+    (TokenType.Q_MARK, r'\?'),
+    (TokenType.LEFT_PAREN, r'\('),
+    (TokenType.RIGHT_PAREN, r'\)'),
+    (TokenType.ADD, r'\+'),
+    (TokenType.MULTIPLY, r'\*'),
+    # Anything else is a single invalid character
+    (TokenType.INVALID, r'[\s\S]'),
+)
+TOKEN_PATTERN = re.compile("|".join("(?P<{}>{})".format(t.name, p) for t, p in TOKEN_PRIORITY))
+# The tokens whose values are interned as symbols
+SYMBOL_TYPES = frozenset((TokenType.ID, TokenType.STRING))
+
+
+class SymbolTable:
+    """
+    Every distinct ID and STRING value as a dense integer, its symbol.  Relations hold and compare symbols instead of
+    tokens, and symbols are only decoded back into text to print them.
+    Symbols are only the same within a process, a token that is unpickled is interned again.
+    """
+    def __init__(self):
+        # The value of each symbol, and the symbol of each value
+        self.values = list()  # type: List[str]
+        self.ids = dict()  # type: Dict[str, int]
+        self.lock = threading.Lock()
+        self._decoded = np.empty(0, dtype=object)
+        self._ranks = np.empty(0, dtype=np.int64)
+        self._numbers = np.full(1, np.nan)
+
+    def intern(self, value: str) -> int:
+        symbol = self.ids.get(value)
+        if symbol is None:
+            with self.lock:
+                symbol = self.ids.get(value)
+                if symbol is None:
+                    symbol = len(self.values)
+                    # A value is only found once it has a symbol to decode
+                    self.values.append(value)
+                    self.ids[value] = symbol
+        return symbol
+
+    def intern_all(self, values: List[str]) -> np.ndarray:
+        """
+        :return: The symbol of each value, interning all of them at once
+        """
+        with self.lock:
+            new = [value for value in dict.fromkeys(values) if value not in self.ids]
+            start = len(self.values)
+            self.values.extend(new)
+            self.ids.update(zip(new, range(start, start + len(new))))
+        return np.fromiter(map(self.ids.__getitem__, values), dtype=np.int64, count=len(values))
+
+    def decode(self, symbols: np.ndarray) -> np.ndarray:
+        """
+        :return: The value of each symbol in an array of symbols
+        """
+        if len(self._decoded) != len(self.values):
+            decoded = np.empty(len(self.values), dtype=object)
+            decoded[:] = self.values[:len(decoded)]
+            self._decoded = decoded
+        return self._decoded[symbols]
+
+    def ranks(self) -> np.ndarray:
+        """
+        :return: The position of each symbol's value in the sorted values, sorting symbols by rank sorts them as text
+        """
+        if len(self._ranks) != len(self.values):
+            values = self.values[:]
+            ranks = np.empty(len(values), dtype=np.int64)
+            # Python sorts a list of strings several times faster than numpy sorts an array of objects
+            ranks[sorted(range(len(values)), key=values.__getitem__)] = np.arange(len(values))
+            self._ranks = ranks
+        return self._ranks
+
+    def numbers(self) -> np.ndarray:
+        """
+        :return: The number that each symbol's value is, or NaN if it isn't one.  The last number is also NaN, so a
+        negative symbol, a missing value, isn't a number either
+        """
+        known = len(self._numbers) - 1
+        if known != len(self.values):
+            new = self.values[known:]
+            self._numbers = np.concatenate((self._numbers[:known], np.fromiter(
+                map(to_number, new), dtype=np.float64, count=len(new)), [np.nan]))
+        return self._numbers
+
+    def __getitem__(self, symbol: int) -> str:
+        return self.values[symbol]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+# A STRING value that is a number: decimal digits with an optional sign and decimal point, and nothing else
+NUMBER = re.compile(r"'[+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)'\Z")
+
+
+def to_number(value: str) -> float:
+    """
+    :return: The number in a STRING value, or NaN if the value isn't a string of a plain decimal number.  Text that
+    float() reads but that isn't written as a decimal number, like 'nan', 'inf', '1e3' or '1_000', isn't a number
+    """
+    if NUMBER.match(value) is None:
+        return np.nan
+    return float(value[1:-1])
+
+
+# The symbols of every program parsed by this process
+SYMBOLS = SymbolTable()
+
+
 class Token:
-    def __init__(self, line_number: int, s_input: str = "", value: str = None, t_type: TokenType = None):
+    # Programs can have millions of tokens, don't give each of them a __dict__
+    __slots__ = ('line_number', 'value', 'type', 'symbol')
+
+    def __init__(self, line_number: int, s_input: str = "", value: str = None, t_type: TokenType = None,
+                 symbol: int = None):
         """
         Choose the token that best matches the input using a certain priority
         :param s_input: 
+        :param symbol: The symbol of the value if it is already interned
         """
         self.line_number = line_number
         if value is not None and t_type is not None:
             self.value = value
             self.type = t_type
-        elif TokenType.EOF.match(s_input):
+        elif not s_input:
             self.type = TokenType.EOF
             self.value = ""
-        elif TokenType.COMMENT.match(s_input):
-            self.type = TokenType.COMMENT
-            self.value = TokenType.COMMENT.match(s_input).group(1)
-        elif TokenType.UNDEFINED.match(s_input):
-            self.type = TokenType.UNDEFINED
-            self.value = TokenType.UNDEFINED.match(s_input).group(1)
-        elif TokenType.STRING.match(s_input):
-            self.type = TokenType.STRING
-            self.value = TokenType.STRING.match(s_input).group(1)
-        elif TokenType.WHITESPACE.match(s_input):
-            self.type = TokenType.WHITESPACE
-            self.value = TokenType.WHITESPACE.match(s_input).group(1)
-        elif TokenType.SCHEMES.match(s_input):
-            self.type = TokenType.SCHEMES
-            self.value = 'Schemes'
-        elif TokenType.FACTS.match(s_input):
-            self.type = TokenType.FACTS
-            self.value = 'Facts'
-        elif TokenType.QUERIES.match(s_input):
-            self.type = TokenType.QUERIES
-            self.value = 'Queries'
-        elif TokenType.RULES.match(s_input):
-            self.type = TokenType.RULES
-            self.value = 'Rules'
-        elif TokenType.ID.match(s_input):
-            self.type = TokenType.ID
-            self.value = TokenType.ID.match(s_input).group(1)
-        elif TokenType.COLON_DASH.match(s_input):
-            self.type = TokenType.COLON_DASH
-            self.value = ':-'
-        elif TokenType.COLON.match(s_input):
-            self.type = TokenType.COLON
-            self.value = ':'
-        elif TokenType.COMMA.match(s_input):
-            self.type = TokenType.COMMA
-            self.value = ','
-        elif TokenType.PERIOD.match(s_input):
-            self.type = TokenType.PERIOD
-            self.value = '.'
-        elif TokenType.Q_MARK.match(s_input):
-            self.type = TokenType.Q_MARK
-            self.value = '?'
-        elif TokenType.LEFT_PAREN.match(s_input):
-            self.type = TokenType.LEFT_PAREN
-            self.value = '('
-        elif TokenType.RIGHT_PAREN.match(s_input):
-            self.type = TokenType.RIGHT_PAREN
-            self.value = ')'
-        elif TokenType.ADD.match(s_input):
-            self.type = TokenType.ADD
-            self.value = '+'
-        elif TokenType.MULTIPLY.match(s_input):
-            self.type = TokenType.MULTIPLY
-            self.value = '*'
         else:
-            self.type = TokenType.INVALID
-            self.value = s_input[0]
-        logger.debug("Created token: {}".format(self).replace('\n', '\\n'))
+            # The alternatives are ordered by priority, so the first one to match is the best token
+            match = TOKEN_PATTERN.match(s_input)
+            self.type = TokenType[match.lastgroup]
+            self.value = match.group()
+        if symbol is None and self.type in SYMBOL_TYPES:
+            symbol = SYMBOLS.intern(self.value)
+        self.symbol = symbol
+        if trace:
+            trace('token', "Created token: {}", str(self).replace('\n', '\\n'))
 
     def __str__(self) -> str:
         return '({},"{}",{})'.format(
@@ -144,6 +237,89 @@ class Token:
     def __bool__(self) -> bool:
         return True if self.value else False
 
+    def __getstate__(self) -> tuple:
+        return self.line_number, self.value, self.type
+
+    def __setstate__(self, state: tuple):
+        self.line_number, self.value, self.type = state
+        self.symbol = SYMBOLS.intern(self.value) if self.type in SYMBOL_TYPES else None
+
+
+class TokenBuffer(Sequence):
+    """
+    A columnar sequence of tokens.
+    Instead of a Python object per token, the type of each token, its offsets in the source and its line number are
+    packed into arrays.  Tokens are only created when they are indexed or iterated over.
+    """
+    types = tuple(TokenType)
+    codes = {t: i for i, t in enumerate(types)}
+
+    def __init__(self, source: str = ""):
+        """
+        :param source: The text that the offsets of each token refer to
+        """
+        self.source = source
+        offset_type = 'I' if len(source) <= 0xFFFFFFFF else 'Q'
+        self.type_codes = array('B')
+        self.starts = array(offset_type)
+        self.ends = array(offset_type)
+        self.line_numbers = array('I')
+
+    def append(self, t_type: TokenType, start: int, end: int, line_number: int):
+        self.type_codes.append(self.codes[t_type])
+        self.starts.append(start)
+        self.ends.append(end)
+        self.line_numbers.append(line_number)
+
+    def extend(self, other: 'TokenBuffer', begin: int = 0, end: int = None, offset: int = 0, lines: int = 0):
+        """
+        Append a range of the tokens from another buffer, moving them by a number of characters and lines
+        :param other: The buffer to copy tokens from
+        :param begin: The index of the first token to copy
+        :param end: The index after the last token to copy, or the end of the buffer
+        :param offset: The number of characters to move the tokens by in the source of this buffer
+        :param lines: The number of lines to move the tokens by
+        """
+        self.type_codes.extend(other.type_codes[begin:end])
+        for column, other_column, shift in (
+                (self.starts, other.starts, offset), (self.ends, other.ends, offset),
+                (self.line_numbers, other.line_numbers, lines)):
+            if shift:
+                # Shift the whole range at once rather than one token at a time
+                shifted = np.frombuffer(other_column, dtype=other_column.typecode)[begin:end].astype(np.int64) + shift
+                column.frombytes(shifted.astype(column.typecode).tobytes())
+            else:
+                column.extend(other_column[begin:end])
+
+    def type(self, index: int) -> TokenType:
+        return self.types[self.type_codes[index]]
+
+    def value(self, index: int) -> str:
+        return self.source[self.starts[index]:self.ends[index]]
+
+    def token(self, index: int) -> Token:
+        return Token(
+            line_number=self.line_numbers[index],
+            value=self.source[self.starts[index]:self.ends[index]],
+            t_type=self.types[self.type_codes[index]]
+        )
+
+    def __getitem__(self, index: int or slice) -> Token or List[Token]:
+        if isinstance(index, slice):
+            return [self.token(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TokenBuffer index out of range")
+        return self.token(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.token(i)
+
+    def __len__(self) -> int:
+        return len(self.type_codes)
+
 
 if __name__ == "__main__":
     from argparse import ArgumentParser
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import logging
+import os
+
+from typing import Callable, Dict
+
+# A finer level than DEBUG for events that happen once per character or token
+TRACE = logging.DEBUG - 5
+logging.addLevelName(TRACE, "TRACE")
+
+# The logger of each subsystem, by the name used to enable it.  These are known before the modules are imported so
+# that tracing can be configured first.  Any other Trace registers its own subsystem when it is created.
+SUBSYSTEMS = {
+    'tokens': 'tokens',
+    'lexer': 'Lexical Analyzer',
+    'parser': 'datalog_parser',
+    'rdbms': 'relational_database',
+    'interpreter': 'datalog_interpreter',
+    'optimizer': 'rule_optimizer',
+    'cache': 'parse_cache',
+    'columns': 'column_store',
+    'store': 'relation_store',
+    'import': 'fact_import',
+    'catalog': 'catalog',
+}  # type: Dict[str, str]
+
+
+class TraceEvent:
+    """
+    The message of a traced log record.  It isn't formatted until a handler actually emits the record.
+    """
+    __slots__ = ('subsystem', 'name', 'message', 'args', 'fields')
+
+    def __init__(self, subsystem: str, name: str, message: str or Callable[[], str], args: tuple, fields: dict):
+        self.subsystem = subsystem
+        self.name = name
+        self.message = message
+        self.args = args
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if callable(self.message):
+            return self.message()
+        elif self.args or self.fields:
+            return self.message.format(*self.args, **self.fields)
+        return self.message
+
+
+class Trace:
+    """
+    Structured trace events for one subsystem, that cost nothing while the subsystem isn't being traced.
+    Events are emitted through the subsystem's logger when it is enabled for DEBUG (or the event's level), carrying the
+    subsystem, the event name and its fields as attributes of the log record.
+    Messages are formatted lazily, and a message that is expensive to build can be passed as a callable.
+    In hot loops read Trace.enabled once before the loop and guard each event with it.
+    """
+    def __init__(self, logger: logging.Logger, subsystem: str):
+        self.logger = logger
+        self.subsystem = subsystem
+        SUBSYSTEMS[subsystem] = logger.name
+
+    @property
+    def enabled(self) -> bool:
+        return self.logger.isEnabledFor(logging.DEBUG)
+
+    def __bool__(self) -> bool:
+        return self.enabled
+
+    def __call__(self, event: str, message: str or Callable[[], str] = "", *args, level: int = logging.DEBUG, **fields):
+        """
+        :param event: The name of the event
+        :param message: A format string for args and fields, or a callable that returns the whole message
+        :param level: The logging level of the event
+        :param fields: Structured data about the event, also available to the format string
+        """
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, TraceEvent(self.subsystem, event, message, args, fields), extra={
+                'trace_subsystem': self.subsystem, 'trace_event': event, 'trace_fields': fields
+            })
+
+
+def enable(*subsystems: str, level: int = logging.DEBUG):
+    """
+    Switch tracing on for the named subsystems, or every subsystem for 'all'
+    :param level: The lowest level of event to emit, use TRACE to include per token events
+    """
+    for name in subsystems:
+        if name == 'all':
+            logger_names = SUBSYSTEMS.values()
+        elif name in SUBSYSTEMS:
+            logger_names = [SUBSYSTEMS[name]]
+        else:
+            raise ValueError("Unknown trace subsystem '{}', choose from: {}".format(
+                name, ", ".join(sorted(SUBSYSTEMS))))
+        for logger_name in logger_names:
+            logging.getLogger(logger_name).setLevel(level)
+
+
+def configure(spec: str = None):
+    """
+    Enable tracing from a comma separated list of subsystems, such as "lexer,parser" or "all".
+    A subsystem can be followed by ':LEVEL' to set its level, for example "lexer:5" to include per token events.
+    :param spec: The subsystems to enable, defaults to the DATALOG_TRACE environment variable
+    """
+    if spec is None:
+        spec = os.environ.get('DATALOG_TRACE', '')
+    for item in spec.split(','):
+        name, _, level = item.strip().partition(':')
+        if name:
+            enable(name, level=int(level) if level else logging.DEBUG)